@@ -1,5 +1,8 @@
+import argparse
+import hashlib
+import secrets
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
@@ -7,7 +10,7 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 from . import crud, models
-from .database import SessionLocal
+from .database import Base, SessionLocal, engine
 from .config import settings  # Используем наш объект настроек
 
 import logging
@@ -43,6 +46,107 @@ def create_access_token(
     return encoded_jwt
 
 
+def hash_refresh_token(token: str) -> str:
+    """
+    Возвращает SHA-256 хэш refresh-токена.
+
+    Токен — 256 случайных бит, поэтому медленный хэш (bcrypt) не нужен: поиск по хэшу
+    обходится одним индексным запросом.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int) -> str:
+    """
+    Выдает новый refresh-токен, начиная новую цепочку ротаций.
+
+    :param db: Сессия основной базы данных.
+    :param user_id: Идентификатор пользователя.
+    :return: Refresh-токен (в базе хранится только его хэш).
+    """
+    token = secrets.token_urlsafe(32)
+    crud.create_refresh_token(
+        db,
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family_id=secrets.token_hex(16),
+        expires_at=datetime.utcnow() + settings.refresh_token_expire
+    )
+    return token
+
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[models.User, str]:
+    """
+    Обменивает refresh-токен на новый той же цепочки.
+
+    Повторное предъявление уже использованного или отозванного токена считается
+    признаком кражи: отзывается вся цепочка, и владельцу потребуется войти по паролю.
+    Исключение — токен, погашенный ротацией не более refresh_token_reuse_grace_seconds
+    назад (вкладки браузера с общим токеном обновляют его одновременно): по нему
+    выдается еще один токен той же цепочки.
+
+    :param db: Сессия основной базы данных.
+    :param token: Предъявленный refresh-токен.
+    :return: Пользователь и новый refresh-токен.
+    :raises HTTPException: 401, если токен недействителен, истек или уже использован.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Недействительный refresh-токен",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    now = datetime.utcnow()
+    token_hash = hash_refresh_token(token)
+    new_token = secrets.token_urlsafe(32)
+    old_token = crud.rotate_refresh_token(
+        db, token_hash, hash_refresh_token(new_token), now, now + settings.refresh_token_expire,
+        revoked_before=now - settings.refresh_token_retention
+    )
+    if old_token is None:
+        user_id = crud.reissue_recently_rotated_refresh_token(
+            db, token_hash, hash_refresh_token(new_token), now,
+            now - timedelta(seconds=settings.refresh_token_reuse_grace_seconds),
+            now + settings.refresh_token_expire
+        )
+        if user_id is not None:
+            user = crud.get_user(db, user_id)
+            if user is None:
+                raise credentials_exception
+            logger.info("Повторное обновление недавно погашенного refresh-токена пользователя %s", user_id)
+            return user, new_token
+
+        stored = crud.get_refresh_token_by_hash(db, token_hash)
+        if stored is not None and stored.revoked_at is not None:
+            logger.warning("Повторное использование refresh-токена пользователя %s, цепочка отозвана", stored.user_id)
+            crud.revoke_refresh_token_family(db, stored.family_id, now)
+        raise credentials_exception
+
+    user = crud.get_user(db, old_token.user_id)
+    if user is None:
+        raise credentials_exception
+    return user, new_token
+
+
+def prune_refresh_tokens() -> int:
+    """
+    Удаляет истекшие refresh-токены и погашенные токены старше refresh_token_retention_days.
+
+    Ротация сама удаляет старые токены своей цепочки; эта функция убирает цепочки,
+    которые больше не обновляются. Запускается периодически командой:
+        python -m app.auth prune-tokens
+
+    :return: Число удаленных токенов.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        deleted = crud.prune_refresh_tokens(db, now, now - settings.refresh_token_retention)
+    finally:
+        db.close()
+    logger.info("Удалено устаревших refresh-токенов: %s", deleted)
+    return deleted
+
+
 def get_db():
     """
     Зависимость для получения сессии базы данных.
@@ -85,3 +189,35 @@ def verify_token(token: str, db: Session) -> models.User:
         logger.warning("Пользователь с username '%s' не найден", username)
         raise credentials_exception
     return user
+
+
+def authenticate_token(token: str) -> models.User:
+    """
+    Проверяет JWT-токен в собственной короткоживущей сессии базы данных.
+
+    Используется долгоживущими подключениями (SSE), которые не должны удерживать
+    сессию запроса на все время соединения.
+
+    :param token: JWT-токен.
+    :return: Объект пользователя, если токен валиден.
+    :raises HTTPException: Если токен недействителен или пользователь не найден.
+    """
+    db = SessionLocal()
+    try:
+        return verify_token(token, db)
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Обслуживание токенов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("prune-tokens", help="Удалить истекшие и давно погашенные refresh-токены")
+    parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    print(f"Удалено токенов: {prune_refresh_tokens()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Модуль групповой фиксации (group commit) операций записи.
+
+SQLite допускает только одного писателя, а каждая мутация crud выполняет собственный
+commit() с fsync. WriteBatcher ставит конкурентные операции записи в очередь, а единственный
+поток-писатель применяет их одной транзакцией — раз в несколько миллисекунд или по
+накоплении N операций. Каждый запрос получает собственный результат или исключение.
+
+Режим включается настройкой write_batch_enabled. Когда он выключен, операции
+выполняются напрямую в сессии запроса, как и раньше.
+
+Использование:
+    from . import batcher
+    db_note = batcher.execute(db, crud.create_note, note, user_id)
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from .config import settings
+from .database import create_session_factory
+
+logger = logging.getLogger(__name__)
+
+# Операция в очереди: функция crud, её аргументы и Future для результата.
+_Operation = Tuple[Callable[..., Any], tuple, dict, Future]
+
+
+class WriteBatcher:
+    """
+    Объединяет конкурентные операции записи в общие транзакции.
+
+    Функции операций вызываются в потоке-писателе как fn(session, *args, **kwargs).
+    Сессия писателя помечена флагом session.info["write_batch"], по которому crud
+    выполняет flush вместо commit. Если хотя бы одна операция пачки завершилась ошибкой,
+    транзакция откатывается, и операции пачки повторяются по одной, чтобы ошибка
+    досталась только своему запросу.
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_delay: float, max_size: int):
+        """
+        :param session_factory: Фабрика сессий базы данных, в которую пишет писатель.
+        :param max_delay: Максимальное время накопления пачки в секундах.
+        :param max_size: Максимальное число операций в одной транзакции.
+        """
+        self._session_factory = session_factory
+        self._max_delay = max_delay
+        self._max_size = max(1, max_size)
+        self._queue: "queue.Queue[Optional[_Operation]]" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Ставит операцию в очередь писателя.
+
+        :param fn: Функция вида fn(session, *args, **kwargs), например crud.create_note.
+        :return: Future, который получит результат функции или её исключение.
+        """
+        if self._closed:
+            raise RuntimeError("WriteBatcher остановлен")
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Останавливает писателя, предварительно применив все операции из очереди.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if batch:
+                self._apply_guarded(batch)
+        # Операции, успевшие попасть в очередь одновременно с остановкой.
+        leftovers = []
+        while True:
+            try:
+                operation = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if operation is not None:
+                leftovers.append(operation)
+        if leftovers:
+            self._apply_guarded(leftovers)
+
+    def _collect(self) -> Tuple[List[_Operation], bool]:
+        """
+        Собирает пачку: ждет первую операцию, затем добирает остальные,
+        пока не истечет max_delay или не наберется max_size операций.
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self._max_delay
+        while len(batch) < self._max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                operation = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if operation is None:
+                return batch, True
+            batch.append(operation)
+        return batch, False
+
+    @staticmethod
+    def _call(session: Session, operation: _Operation) -> Any:
+        fn, args, kwargs, _ = operation
+        return fn(session, *args, **kwargs)
+
+    def _apply_guarded(self, batch: List[_Operation]) -> None:
+        """
+        Применяет пачку так, чтобы непредвиденная ошибка (например, потеря соединения
+        при откате) не остановила поток-писатель: она передается незавершенным
+        операциям пачки, а писатель продолжает обрабатывать очередь.
+        """
+        try:
+            self._apply(batch)
+        except Exception as e:
+            logger.error("Непредвиденная ошибка писателя при применении пачки: %s", e)
+            for operation in batch:
+                future = operation[3]
+                if not future.done():
+                    future.set_exception(e)
+
+    def _apply(self, batch: List[_Operation]) -> None:
+        operations = [op for op in batch if op[3].set_running_or_notify_cancel()]
+        if not operations:
+            return
+
+        session = self._session_factory(expire_on_commit=False, info={"write_batch": True})
+        try:
+            results = []
+            for operation in operations:
+                results.append(self._call(session, operation))
+                # Операции пачки делят одну сессию: без отсоединения две мутации одной
+                # заметки получили бы из identity map один объект, и результат первой
+                # перезаписался бы значениями второй.
+                session.flush()
+                session.expunge_all()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning("Ошибка в пачке из %s операций, повтор по одной: %s", len(operations), e)
+            for operation in operations:
+                self._apply_single(operation)
+            return
+        finally:
+            session.close()
+
+        for operation, result in zip(operations, results):
+            operation[3].set_result(result)
+
+    def _apply_single(self, operation: _Operation) -> None:
+        session = self._session_factory(expire_on_commit=False)
+        try:
+            operation[3].set_result(self._call(session, operation))
+        except Exception as e:
+            session.rollback()
+            operation[3].set_exception(e)
+        finally:
+            session.close()
+
+
+# Писатели по одному на каждую базу данных (основную и каждый шард заметок).
+_batchers: Dict[Engine, WriteBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_write_batcher(bind: Engine) -> Optional[WriteBatcher]:
+    """
+    Возвращает WriteBatcher для указанной базы, создавая его при первом обращении.
+
+    :param bind: Engine базы данных, в которую выполняется запись.
+    :return: WriteBatcher или None, если групповая фиксация выключена в настройках.
+    """
+    if not settings.write_batch_enabled:
+        return None
+    with _batchers_lock:
+        write_batcher = _batchers.get(bind)
+        if write_batcher is None:
+            write_batcher = WriteBatcher(
+                create_session_factory(bind),
+                max_delay=settings.write_batch_max_delay_ms / 1000,
+                max_size=settings.write_batch_max_size,
+            )
+            _batchers[bind] = write_batcher
+        return write_batcher
+
+
+def shutdown_write_batcher() -> None:
+    """
+    Останавливает все созданные WriteBatcher.
+    """
+    with _batchers_lock:
+        for write_batcher in _batchers.values():
+            write_batcher.close()
+        _batchers.clear()
+
+
+def execute(db: Session, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Выполняет операцию записи через WriteBatcher или напрямую в сессии запроса.
+
+    Операция попадает к писателю той же базы, к которой привязана сессия запроса,
+    поэтому при шардировании у каждого шарда своя очередь.
+
+    Ожидание результата ограничено настройкой write_batch_timeout_seconds. Если операция
+    к этому моменту не начала выполняться, она отменяется; начатая операция может
+    быть применена и после истечения ожидания.
+
+    :param db: Сессия запроса; используется, если групповая фиксация выключена.
+    :param fn: Функция crud вида fn(session, *args, **kwargs).
+    :return: Результат функции. Исключение функции пробрасывается вызывающему.
+    :raises concurrent.futures.TimeoutError: Если писатель не ответил за отведенное время.
+    """
+    write_batcher = get_write_batcher(db.get_bind())
+    if write_batcher is None:
+        return fn(db, *args, **kwargs)
+    future = write_batcher.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=settings.write_batch_timeout_seconds)
+    except FutureTimeoutError:
+        future.cancel()
+        logger.error("Писатель не выполнил операцию %s за %s с",
+                     getattr(fn, "__name__", fn), settings.write_batch_timeout_seconds)
+        raise
@@ -0,0 +1,279 @@
+"""
+Модуль хранения больших текстов заметок вне таблицы notes.
+
+Тексты длиннее blob_threshold_bytes (в UTF-8) сохраняются файлами в blob_dir, а в строке
+заметки остаются пустой body и ссылка body_ref — SHA-256 текста. Одинаковые тексты
+хранятся одним файлом. Файлы раскладываются по подкаталогам из первых символов хэша:
+    blobs/ab/cd/abcd...
+
+Текст вынесенной заметки отдает эндпоинт GET /notes/{note_id}/body через FileResponse
+(sendfile, поддержка Range), поэтому он не проходит через SQLAlchemy, Pydantic и JSON.
+
+Файлы не удаляются при изменении заметок. Неиспользуемые файлы удаляет сборщик мусора,
+а тексты, сохраненные в таблице до появления хранилища, переносит команда migrate:
+    python -m app.blobstore gc
+    python -m app.blobstore migrate
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Файл, отложенный сборщиком мусора до проверки времени изменения: <хэш>.<uuid>.gc
+GC_PENDING_PATTERN = re.compile(r"^([0-9a-f]{64})\.[0-9a-f]{32}\.gc$")
+
+
+class BlobStore:
+    """
+    Хранилище файлов, адресуемых по SHA-256 содержимого.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data: bytes) -> str:
+        """
+        Сохраняет данные и возвращает их хэш. Если такой файл уже есть, он не перезаписывается.
+
+        У существующего файла обновляется время изменения, чтобы сборщик мусора
+        не удалил его до фиксации транзакции, которая на него ссылается.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        try:
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return digest
+
+    def path(self, digest: str) -> Optional[str]:
+        """
+        Возвращает путь к файлу или None, если хэш некорректен или файл не найден.
+        """
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        path = self._path(digest)
+        return path if os.path.isfile(path) else None
+
+    def delete_if_expired(self, digest: str, cutoff: float) -> bool:
+        """
+        Удаляет файл, если он не изменялся с момента cutoff, атомарно относительно put().
+
+        Файл сначала переименовывается, и время изменения проверяется уже у переименованного
+        файла. put(), выполненный до переименования, обновил это время — файл возвращается
+        на место. put(), выполненный после, не находит файл и записывает его заново.
+
+        :return: True, если файл удален.
+        """
+        path = self._path(digest)
+        pending_path = f"{path}.{uuid.uuid4().hex}.gc"
+        try:
+            os.rename(path, pending_path)
+        except FileNotFoundError:
+            return False
+        if os.path.getmtime(pending_path) < cutoff:
+            os.remove(pending_path)
+            return True
+        # Содержимое совпадает, поэтому файл, заново записанный put(), можно заменить.
+        os.replace(pending_path, path)
+        return False
+
+    def restore_pending(self) -> int:
+        """
+        Возвращает на место файлы, отложенные прерванной сборкой мусора.
+
+        :return: Число возвращенных файлов.
+        """
+        restored = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                match = GC_PENDING_PATTERN.match(name)
+                if match:
+                    os.replace(os.path.join(directory, name), self._path(match.group(1)))
+                    restored += 1
+        return restored
+
+    def iter_digests(self) -> Iterator[str]:
+        """
+        Перечисляет хэши всех сохраненных файлов.
+        """
+        for _, _, names in os.walk(self.root):
+            for name in names:
+                if DIGEST_PATTERN.match(name):
+                    yield name
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Возвращает хранилище, настроенное по параметрам приложения.
+    """
+    return BlobStore(settings.blob_dir)
+
+
+def offload_body(values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выносит текст заметки в хранилище, если он больше порога blob_threshold_bytes.
+
+    :param values: Значения столбцов для INSERT или UPDATE заметки.
+    :return: Новый словарь: с пустым body и body_ref, если текст вынесен; с body_ref=None,
+             если передан короткий текст; без изменений, если body не передан.
+    """
+    body = values.get("body")
+    if body is None:
+        return values
+    values = dict(values)
+    data = body.encode("utf-8")
+    if 0 < settings.blob_threshold_bytes < len(data):
+        values["body"] = ""
+        values["body_ref"] = get_blob_store().put(data)
+    else:
+        values["body_ref"] = None
+    return values
+
+
+def collect_garbage(router, store: BlobStore, grace_seconds: float) -> int:
+    """
+    Удаляет файлы, на которые не ссылается ни одна заметка ни в одном шарде.
+
+    Файлы моложе grace_seconds не удаляются: на них могут ссылаться еще не
+    зафиксированные транзакции. Возраст отсчитывается от начала чтения ссылок и
+    проверяется повторно при удалении (BlobStore.delete_if_expired): put() обновляет
+    время изменения повторно используемого файла или записывает удаленный файл заново,
+    поэтому файл, на который сослались после чтения ссылок, остается в хранилище.
+
+    :param router: ShardRouter, через который опрашиваются все базы с заметками.
+    :param store: Хранилище.
+    :param grace_seconds: Минимальный возраст удаляемого файла.
+    :return: Число удаленных файлов.
+    """
+    restored = store.restore_pending()
+    if restored:
+        logger.warning("Возвращено файлов, отложенных прерванной сборкой мусора: %s", restored)
+    cutoff = time.time() - grace_seconds
+
+    def is_expired(digest: str) -> bool:
+        path = store.path(digest)
+        try:
+            return path is not None and os.path.getmtime(path) < cutoff
+        except FileNotFoundError:
+            return False
+
+    candidates = [digest for digest in store.iter_digests() if is_expired(digest)]
+
+    def referenced(db: Session) -> set:
+        stmt = select(models.Note.body_ref).where(models.Note.body_ref.isnot(None)).distinct()
+        return set(db.scalars(stmt))
+
+    in_use = set().union(*router.fan_out(referenced))
+    removed = 0
+    for digest in candidates:
+        if digest not in in_use and store.delete_if_expired(digest, cutoff):
+            removed += 1
+    logger.info("Сборка мусора хранилища: удалено файлов %s", removed)
+    return removed
+
+
+def migrate_inline_bodies(router, store: BlobStore, batch_size: int = 100) -> int:
+    """
+    Переносит в хранилище тексты, сохраненные в таблице и превышающие порог.
+
+    Заметка обновляется условным UPDATE по updated_at, поэтому изменение, сделанное
+    пользователем во время переноса, не перезаписывается. updated_at при переносе
+    не меняется.
+
+    :param router: ShardRouter, через который обходятся все базы с заметками.
+    :param store: Хранилище.
+    :param batch_size: Число заметок, обрабатываемых одной транзакцией.
+    :return: Число перенесенных заметок.
+    """
+    threshold = settings.blob_threshold_bytes
+    if threshold <= 0:
+        return 0
+    note = models.Note
+
+    def migrate(db: Session) -> int:
+        migrated = 0
+        last_id = 0
+        while True:
+            # Символ в UTF-8 занимает не больше 4 байт: отсекаем заведомо короткие тексты в SQL.
+            rows = db.execute(
+                select(note.id, note.body, note.updated_at)
+                .where(note.id > last_id, note.body_ref.is_(None), func.length(note.body) * 4 > threshold)
+                .order_by(note.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return migrated
+            for note_id, body, updated_at in rows:
+                data = body.encode("utf-8")
+                if len(data) <= threshold:
+                    continue
+                result = db.execute(
+                    update(note)
+                    .where(note.id == note_id, note.body_ref.is_(None), note.updated_at == updated_at)
+                    .values(body="", body_ref=store.put(data), updated_at=updated_at)
+                )
+                migrated += result.rowcount
+            db.commit()
+            last_id = rows[-1].id
+
+    migrated = sum(router.fan_out(migrate))
+    logger.info("Перенесено текстов заметок в хранилище: %s", migrated)
+    return migrated
+
+
+def main() -> None:
+    from .database import Base, add_missing_columns, engine
+    from .sharding import get_router
+
+    parser = argparse.ArgumentParser(description="Инструменты хранилища текстов заметок")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gc = commands.add_parser("gc", help="Удалить файлы, на которые не ссылается ни одна заметка")
+    gc.add_argument("--grace-seconds", type=float, default=settings.blob_gc_grace_seconds,
+                    help="Минимальный возраст удаляемого файла")
+    commands.add_parser("migrate", help="Перенести большие тексты из таблицы в хранилище")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, models.Note.__table__)
+    if args.command == "gc":
+        print(f"Удалено файлов: {collect_garbage(get_router(), get_blob_store(), args.grace_seconds)}")
+    else:
+        print(f"Перенесено заметок: {migrate_inline_bodies(get_router(), get_blob_store())}")
+
+
+if __name__ == "__main__":
+    main()
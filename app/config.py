@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 from datetime import timedelta
+from typing import List
 
 
 class Settings(BaseSettings):
@@ -13,6 +14,58 @@ class Settings(BaseSettings):
     # Время жизни токена в минутах.
     access_token_expire_minutes: int = 30
 
+    # Групповая фиксация (group commit) мутаций заметок. По умолчанию выключена.
+    write_batch_enabled: bool = False
+
+    # Максимальное время накопления пачки записей в миллисекундах.
+    write_batch_max_delay_ms: float = 5.0
+
+    # Максимальное число операций, применяемых одной транзакцией.
+    write_batch_max_size: int = 64
+
+    # Максимальное время ожидания запросом результата операции от писателя, в секундах.
+    write_batch_timeout_seconds: float = 30.0
+
+    # URL баз данных шардов заметок (JSON-список в переменной SHARD_DATABASE_URLS).
+    # Пустой список означает, что заметки хранятся в основной базе вместе с пользователями.
+    shard_database_urls: List[str] = []
+
+    # Размер блока ID заметок, который процесс резервирует в основной базе за одно обращение.
+    note_id_block_size: int = 1000
+
+    # Брокер событий заметок: путь к классу, реализующему app.events.Broker.
+    event_broker: str = "app.events.LocalBroker"
+
+    # Интервал heartbeat-комментариев в потоке /notes/events, в секундах.
+    sse_heartbeat_seconds: float = 15.0
+
+    # Размер очереди событий одного SSE-подключения; при переполнении клиент отключается.
+    sse_queue_size: int = 100
+
+    # Число последних событий, хранимых для возобновления по Last-Event-ID.
+    sse_history_size: int = 1000
+
+    # Доля запросов, профилируемых без заголовка X-Profile (0 — только по заголовку администратора).
+    profile_sample_rate: float = 0.0
+
+    # Интервал снятия стеков сэмплирующим профайлером, в миллисекундах.
+    profile_sample_interval_ms: float = 5.0
+
+    # Директория для снимков профилирования и максимальное число хранимых снимков.
+    profile_dir: str = "./profiles"
+    profile_max_captures: int = 50
+
+    # Директория хранилища больших текстов заметок (общая для всех шардов).
+    blob_dir: str = "./blobs"
+
+    # Тексты заметок больше этого размера в байтах (UTF-8) хранятся в blob_dir,
+    # а в таблице notes остается только ссылка. 0 — все тексты хранятся в таблице.
+    # Выключено по умолчанию: у вынесенной заметки в ответах API пустой body.
+    blob_threshold_bytes: int = 0
+
+    # Минимальный возраст неиспользуемого файла, после которого сборщик мусора его удаляет, в секундах.
+    blob_gc_grace_seconds: int = 3600
+
     @property
     def access_token_expire(self) -> timedelta:
         """
@@ -20,6 +73,31 @@ class Settings(BaseSettings):
         """
         return timedelta(minutes=self.access_token_expire_minutes)
 
+    # Время жизни refresh-токена в днях.
+    refresh_token_expire_days: int = 30
+
+    @property
+    def refresh_token_expire(self) -> timedelta:
+        """
+        Возвращает время жизни refresh-токена в виде timedelta.
+        """
+        return timedelta(days=self.refresh_token_expire_days)
+
+    # Сколько секунд после ротации refresh-токен еще можно предъявить без отзыва цепочки:
+    # вкладки браузера с общим токеном обновляют его одновременно.
+    refresh_token_reuse_grace_seconds: int = 10
+
+    # Сколько дней хранятся погашенные refresh-токены для обнаружения повторного использования.
+    # Более старые погашенные и все истекшие токены удаляются.
+    refresh_token_retention_days: int = 7
+
+    @property
+    def refresh_token_retention(self) -> timedelta:
+        """
+        Возвращает срок хранения погашенных refresh-токенов в виде timedelta.
+        """
+        return timedelta(days=self.refresh_token_retention_days)
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
@@ -1,6 +1,8 @@
-from typing import Optional, List
-from sqlalchemy.orm import Session
-from . import models, schemas
+from datetime import datetime
+from typing import Any, Dict, Optional, List, Union
+from sqlalchemy import delete, exists, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session, aliased
+from . import blobstore, models, schemas
 from passlib.context import CryptContext
 import logging
 
@@ -10,6 +12,29 @@ logger = logging.getLogger(__name__)
 # Создаем объект для хэширования паролей (используем bcrypt)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+def _commit(db: Session) -> None:
+    """
+    Фиксирует изменения.
+
+    В сессии писателя WriteBatcher (флаг db.info["write_batch"]) выполняется только flush:
+    общую транзакцию пачки фиксирует сам писатель.
+
+    :param db: Сессия SQLAlchemy.
+    """
+    if db.info.get("write_batch"):
+        db.flush()
+    else:
+        db.commit()
+
+def _rollback(db: Session) -> None:
+    """
+    Откатывает транзакцию, если ею управляет сам вызывающий код.
+
+    Транзакцию пачки WriteBatcher откатывает писатель, поэтому здесь она не трогается.
+    """
+    if not db.info.get("write_batch"):
+        db.rollback()
+
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     """
     Получает пользователя по его имени.
@@ -20,6 +45,16 @@ def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     """
     return db.query(models.User).filter_by(username=username).first()
 
+def get_user(db: Session, user_id: int) -> Optional[models.User]:
+    """
+    Получает пользователя по его ID.
+
+    :param db: Сессия SQLAlchemy.
+    :param user_id: Идентификатор пользователя.
+    :return: Объект пользователя или None, если пользователь не найден.
+    """
+    return db.get(models.User, user_id)
+
 def create_user(db: Session, user: schemas.UserCreate) -> models.User:
     """
     Создает нового пользователя с хэшированием пароля.
@@ -44,22 +79,43 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
         raise e
     return db_user
 
-def create_note(db: Session, note: schemas.NoteCreate, user_id: int) -> models.Note:
+def prepare_note_values(note: Union[schemas.NoteCreate, schemas.NoteUpdate]) -> Dict[str, Any]:
     """
-    Создает новую заметку для пользователя.
+    Преобразует схему заметки в значения столбцов, вынося большой текст в хранилище app.blobstore.
+
+    Вызывается в потоке запроса до batcher.execute, чтобы запись файла и fsync
+    не задерживали поток-писатель WriteBatcher и остальные операции пачки.
+
+    :param note: Схема создания или обновления заметки (учитываются только переданные поля).
+    :return: Значения столбцов для create_note или update_note.
+    """
+    return blobstore.offload_body(note.dict(exclude_unset=True))
+
+def create_note(
+        db: Session,
+        note: Union[schemas.NoteCreate, Dict[str, Any]],
+        user_id: int,
+        note_id: Optional[int] = None
+) -> models.Note:
+    """
+    Создает новую заметку для пользователя одним запросом INSERT ... RETURNING.
 
     :param db: Сессия SQLAlchemy.
-    :param note: Схема создания заметки.
+    :param note: Значения, подготовленные prepare_note_values, или схема создания заметки
+                 (в этом случае prepare_note_values вызывается здесь).
     :param user_id: Идентификатор владельца заметки.
+    :param note_id: Заранее выделенный ID заметки (при шардировании). Если не указан, ID назначает база.
     :return: Созданный объект модели Note.
     """
-    db_note = models.Note(**note.dict(), owner_id=user_id)
+    values = dict(note) if isinstance(note, dict) else prepare_note_values(note)
+    if note_id is not None:
+        values["id"] = note_id
+    stmt = insert(models.Note).values(**values, owner_id=user_id).returning(models.Note)
     try:
-        db.add(db_note)
-        db.commit()
-        db.refresh(db_note)
+        db_note = db.scalars(stmt).one()
+        _commit(db)
     except Exception as e:
-        db.rollback()
+        _rollback(db)
         logger.error("Ошибка при создании заметки: %s", e)
         raise e
     return db_note
@@ -87,73 +143,117 @@ def get_notes_by_owner(db: Session, owner_id: int) -> List[models.Note]:
         models.Note.is_deleted == False
     ).all()
 
-def get_all_notes(db: Session) -> List[models.Note]:
+def get_all_notes(db: Session, skip: int = 0, limit: Optional[int] = None) -> List[models.Note]:
     """
-    Получает список всех заметок, не удалённых (для администратора).
+    Получает список всех заметок, не удалённых (для администратора), упорядоченный по ID.
 
     :param db: Сессия SQLAlchemy.
+    :param skip: Число пропускаемых заметок.
+    :param limit: Максимальное число заметок; None — без ограничения.
     :return: Список заметок.
     """
-    return db.query(models.Note).filter(models.Note.is_deleted == False).all()
+    return db.query(models.Note).filter(
+        models.Note.is_deleted == False
+    ).order_by(models.Note.id).offset(skip).limit(limit).all()
+
+def _owned_note_filter(note_id: int, owner_id: int) -> tuple:
+    """
+    Условие WHERE для заметки, принадлежащей владельцу и не удаленной.
+    """
+    return (
+        models.Note.id == note_id,
+        models.Note.owner_id == owner_id,
+        models.Note.is_deleted == False
+    )
 
-def update_note(db: Session, note: models.Note, note_update: schemas.NoteUpdate) -> models.Note:
+def update_note(
+        db: Session,
+        note_id: int,
+        owner_id: int,
+        note_update: Union[schemas.NoteUpdate, Dict[str, Any]]
+) -> Optional[models.Note]:
     """
-    Обновляет заметку с новыми данными из note_update.
+    Обновляет заметку владельца одним условным запросом UPDATE ... RETURNING.
+
+    Проверка владельца и флага удаления выполняется в WHERE того же запроса.
 
     :param db: Сессия SQLAlchemy.
-    :param note: Объект заметки, который необходимо обновить.
-    :param note_update: Схема обновления заметки.
-    :return: Обновленный объект заметки.
+    :param note_id: ID заметки.
+    :param owner_id: Идентификатор пользователя, который должен владеть заметкой.
+    :param note_update: Значения, подготовленные prepare_note_values, или схема обновления заметки.
+    :return: Обновленный объект заметки или None, если подходящая заметка не найдена.
     """
-    update_data = note_update.dict(exclude_unset=True)
+    if isinstance(note_update, dict):
+        update_data = dict(note_update)
+    else:
+        update_data = prepare_note_values(note_update)
     if not update_data:
-        logger.info("Нет данных для обновления заметки с id %s", note.id)
-        return note
+        logger.info("Нет данных для обновления заметки с id %s", note_id)
+        return db.scalars(select(models.Note).where(*_owned_note_filter(note_id, owner_id))).first()
 
-    for key, value in update_data.items():
-        setattr(note, key, value)
+    stmt = (
+        update(models.Note)
+        .where(*_owned_note_filter(note_id, owner_id))
+        .values(**update_data)
+        .returning(models.Note)
+    )
     try:
-        db.commit()
-        db.refresh(note)
+        note = db.scalars(stmt).first()
+        _commit(db)
     except Exception as e:
-        db.rollback()
-        logger.error("Ошибка при обновлении заметки с id %s: %s", note.id, e)
+        _rollback(db)
+        logger.error("Ошибка при обновлении заметки с id %s: %s", note_id, e)
         raise e
     return note
 
-def delete_note(db: Session, note: models.Note) -> models.Note:
+def delete_note(db: Session, note_id: int, owner_id: int) -> Optional[models.Note]:
     """
-    Мягко удаляет заметку, устанавливая флаг is_deleted в True.
+    Мягко удаляет заметку владельца, устанавливая флаг is_deleted в True.
+
+    Выполняется одним условным запросом UPDATE ... RETURNING.
 
     :param db: Сессия SQLAlchemy.
-    :param note: Объект заметки для удаления.
-    :return: Обновленный объект заметки с is_deleted=True.
+    :param note_id: ID заметки.
+    :param owner_id: Идентификатор пользователя, который должен владеть заметкой.
+    :return: Обновленный объект заметки с is_deleted=True или None, если подходящая заметка не найдена.
     """
-    note.is_deleted = True
+    stmt = (
+        update(models.Note)
+        .where(*_owned_note_filter(note_id, owner_id))
+        .values(is_deleted=True)
+        .returning(models.Note)
+    )
     try:
-        db.commit()
-        db.refresh(note)
+        note = db.scalars(stmt).first()
+        _commit(db)
     except Exception as e:
-        db.rollback()
-        logger.error("Ошибка при удалении заметки с id %s: %s", note.id, e)
+        _rollback(db)
+        logger.error("Ошибка при удалении заметки с id %s: %s", note_id, e)
         raise e
     return note
 
-def restore_note(db: Session, note: models.Note) -> models.Note:
+def restore_note(db: Session, note_id: int) -> Optional[models.Note]:
     """
     Восстанавливает ранее удаленную заметку (сбрасывая флаг is_deleted).
 
+    Выполняется одним условным запросом UPDATE ... RETURNING.
+
     :param db: Сессия SQLAlchemy.
-    :param note: Объект заметки для восстановления.
-    :return: Обновленный объект заметки с is_deleted=False.
+    :param note_id: ID заметки.
+    :return: Обновленный объект заметки с is_deleted=False или None, если удаленная заметка не найдена.
     """
-    note.is_deleted = False
+    stmt = (
+        update(models.Note)
+        .where(models.Note.id == note_id, models.Note.is_deleted == True)
+        .values(is_deleted=False)
+        .returning(models.Note)
+    )
     try:
-        db.commit()
-        db.refresh(note)
+        note = db.scalars(stmt).first()
+        _commit(db)
     except Exception as e:
-        db.rollback()
-        logger.error("Ошибка при восстановлении заметки с id %s: %s", note.id, e)
+        _rollback(db)
+        logger.error("Ошибка при восстановлении заметки с id %s: %s", note_id, e)
         raise e
     return note
 
@@ -166,3 +266,270 @@ def get_notes_by_user(db: Session, user_id: int) -> List[models.Note]:
     :return: Список заметок пользователя.
     """
     return db.query(models.Note).filter(models.Note.owner_id == user_id).all()
+
+def get_note_owner_ids(db: Session) -> List[int]:
+    """
+    Получает ID всех пользователей, у которых есть заметки в базе.
+
+    :param db: Сессия SQLAlchemy.
+    :return: Список ID владельцев по возрастанию.
+    """
+    return list(db.scalars(select(models.Note.owner_id).distinct().order_by(models.Note.owner_id)))
+
+def get_max_note_id(db: Session) -> int:
+    """
+    Получает наибольший ID заметки в базе.
+
+    :param db: Сессия SQLAlchemy.
+    :return: Наибольший ID или 0, если заметок нет.
+    """
+    return db.scalar(select(func.max(models.Note.id))) or 0
+
+def get_user_shard(db: Session, user_id: int) -> Optional[int]:
+    """
+    Получает номер шарда, за которым явно закреплен пользователь.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param user_id: Идентификатор пользователя.
+    :return: Номер шарда или None, если пользователь размещается по хэшу.
+    """
+    return db.scalar(select(models.UserShard.shard).where(models.UserShard.user_id == user_id))
+
+def set_user_shard(db: Session, user_id: int, shard: int) -> None:
+    """
+    Закрепляет пользователя за шардом.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param user_id: Идентификатор пользователя.
+    :param shard: Номер шарда.
+    """
+    try:
+        db.merge(models.UserShard(user_id=user_id, shard=shard))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при закреплении пользователя %s за шардом %s: %s", user_id, shard, e)
+        raise e
+
+def create_refresh_token(
+        db: Session,
+        user_id: int,
+        token_hash: str,
+        family_id: str,
+        expires_at: datetime
+) -> None:
+    """
+    Сохраняет хэш нового refresh-токена.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param user_id: Идентификатор пользователя.
+    :param token_hash: SHA-256 хэш токена.
+    :param family_id: Идентификатор цепочки ротаций.
+    :param expires_at: Дата и время истечения токена.
+    """
+    stmt = insert(models.RefreshToken).values(
+        user_id=user_id, token_hash=token_hash, family_id=family_id, expires_at=expires_at
+    )
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при создании refresh-токена для пользователя %s: %s", user_id, e)
+        raise e
+
+def get_refresh_token_by_hash(db: Session, token_hash: str) -> Optional[models.RefreshToken]:
+    """
+    Получает refresh-токен по его хэшу.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param token_hash: SHA-256 хэш токена.
+    :return: Объект токена или None, если токен не найден.
+    """
+    return db.scalars(select(models.RefreshToken).where(models.RefreshToken.token_hash == token_hash)).first()
+
+def rotate_refresh_token(
+        db: Session,
+        token_hash: str,
+        new_token_hash: str,
+        now: datetime,
+        expires_at: datetime,
+        revoked_before: Optional[datetime] = None
+) -> Optional[models.RefreshToken]:
+    """
+    Гасит активный refresh-токен и выдает вместо него новый в той же цепочке, одной транзакцией.
+
+    Токен гасится условным UPDATE ... RETURNING, поэтому при одновременном предъявлении
+    одного токена ротацию выполнит только один запрос. В той же транзакции из цепочки
+    удаляются токены, погашенные раньше revoked_before, поэтому число строк одного
+    клиента не растет бесконечно.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param token_hash: Хэш предъявленного токена.
+    :param new_token_hash: Хэш нового токена.
+    :param now: Текущее время.
+    :param expires_at: Дата и время истечения нового токена.
+    :param revoked_before: Граница хранения погашенных токенов цепочки; None — не удалять.
+    :return: Погашенный токен или None, если токен не найден, истек или уже был использован.
+    """
+    stmt = (
+        update(models.RefreshToken)
+        .where(
+            models.RefreshToken.token_hash == token_hash,
+            models.RefreshToken.revoked_at.is_(None),
+            models.RefreshToken.expires_at > now
+        )
+        .values(revoked_at=now)
+        .returning(models.RefreshToken)
+    )
+    try:
+        old_token = db.scalars(stmt).first()
+        if old_token is None:
+            db.rollback()
+            return None
+        db.execute(insert(models.RefreshToken).values(
+            user_id=old_token.user_id,
+            token_hash=new_token_hash,
+            family_id=old_token.family_id,
+            expires_at=expires_at
+        ))
+        if revoked_before is not None:
+            db.execute(
+                delete(models.RefreshToken)
+                .where(
+                    models.RefreshToken.family_id == old_token.family_id,
+                    models.RefreshToken.revoked_at < revoked_before
+                )
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при ротации refresh-токена: %s", e)
+        raise e
+    return old_token
+
+def reissue_recently_rotated_refresh_token(
+        db: Session,
+        token_hash: str,
+        new_token_hash: str,
+        now: datetime,
+        rotated_since: datetime,
+        expires_at: datetime
+) -> Optional[int]:
+    """
+    Выдает новый токен той же цепочки по недавно погашенному токену одним INSERT ... SELECT.
+
+    Токен принимается, если он погашен не раньше rotated_since, а в его цепочке есть
+    активный токен, то есть цепочка не отозвана выходом или администратором.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param token_hash: Хэш предъявленного токена.
+    :param new_token_hash: Хэш нового токена.
+    :param now: Текущее время.
+    :param rotated_since: Начало допустимого окна после ротации.
+    :param expires_at: Дата и время истечения нового токена.
+    :return: Идентификатор пользователя или None, если токен не подходит.
+    """
+    token = aliased(models.RefreshToken)
+    active = select(models.RefreshToken.id).where(
+        models.RefreshToken.family_id == token.family_id,
+        models.RefreshToken.revoked_at.is_(None),
+        models.RefreshToken.expires_at > now
+    )
+    source = (
+        select(
+            token.user_id, literal(new_token_hash), token.family_id,
+            literal(now), literal(expires_at)
+        )
+        .where(token.token_hash == token_hash, token.revoked_at >= rotated_since, exists(active))
+    )
+    stmt = insert(models.RefreshToken).from_select(
+        ["user_id", "token_hash", "family_id", "created_at", "expires_at"], source
+    ).returning(models.RefreshToken.user_id)
+    try:
+        user_id = db.scalar(stmt)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при повторной выдаче refresh-токена: %s", e)
+        raise e
+    return user_id
+
+def prune_refresh_tokens(db: Session, now: datetime, revoked_before: datetime) -> int:
+    """
+    Удаляет истекшие refresh-токены и токены, погашенные раньше revoked_before.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param now: Текущее время.
+    :param revoked_before: Граница хранения погашенных токенов.
+    :return: Число удаленных токенов.
+    """
+    stmt = (
+        delete(models.RefreshToken)
+        .where(or_(models.RefreshToken.expires_at <= now, models.RefreshToken.revoked_at < revoked_before))
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        deleted = db.execute(stmt).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при удалении устаревших refresh-токенов: %s", e)
+        raise e
+    return deleted
+
+def revoke_refresh_token_family(db: Session, family_id: str, now: datetime) -> int:
+    """
+    Отзывает все активные токены цепочки ротаций.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param family_id: Идентификатор цепочки.
+    :param now: Текущее время.
+    :return: Число отозванных токенов.
+    """
+    return _revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id, now)
+
+def revoke_refresh_token_family_by_hash(db: Session, token_hash: str, now: datetime) -> int:
+    """
+    Отзывает цепочку ротаций, к которой принадлежит токен (выход из системы).
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param token_hash: Хэш любого токена цепочки.
+    :param now: Текущее время.
+    :return: Число отозванных токенов.
+    """
+    family = select(models.RefreshToken.family_id).where(
+        models.RefreshToken.token_hash == token_hash
+    ).scalar_subquery()
+    return _revoke_refresh_tokens(db, models.RefreshToken.family_id == family, now)
+
+def revoke_user_refresh_tokens(db: Session, user_id: int, now: datetime) -> int:
+    """
+    Отзывает все активные refresh-токены пользователя.
+
+    :param db: Сессия SQLAlchemy основной базы.
+    :param user_id: Идентификатор пользователя.
+    :param now: Текущее время.
+    :return: Число отозванных токенов.
+    """
+    return _revoke_refresh_tokens(db, models.RefreshToken.user_id == user_id, now)
+
+def _revoke_refresh_tokens(db: Session, condition, now: datetime) -> int:
+    """
+    Отзывает активные refresh-токены, удовлетворяющие условию, одним запросом UPDATE.
+    """
+    stmt = (
+        update(models.RefreshToken)
+        .where(condition, models.RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        revoked = db.execute(stmt).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при отзыве refresh-токенов: %s", e)
+        raise e
+    return revoked
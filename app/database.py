@@ -5,6 +5,8 @@
 - Получает URL подключения из переменной окружения DATABASE_URL (по умолчанию используется SQLite).
 - Создает объект engine для подключения к базе данных.
 - Настраивает фабрику сессий SessionLocal для создания сессий.
+- Предоставляет create_db_engine и create_session_factory для дополнительных баз (шардов).
+- Предоставляет add_missing_columns для добавления новых столбцов в существующие таблицы.
 - Определяет базовый класс Base для всех моделей SQLAlchemy.
 
 Использование:
@@ -14,24 +16,65 @@
 """
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import Table, create_engine, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Получаем URL подключения из переменной окружения или используем SQLite по умолчанию
 SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./notes.db")
 
-# Для SQLite используем параметр connect_args, чтобы отключить проверку потоков
-connect_args = {"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
 
-# Создаем объект engine с параметром future=True для использования нового API SQLAlchemy 2.0
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args,
-    future=True
-)
+def create_db_engine(url: str) -> Engine:
+    """
+    Создает engine для указанного URL с общими для проекта параметрами.
+
+    Используется как для основной базы, так и для баз шардов заметок.
+    """
+    # Для SQLite используем параметр connect_args, чтобы отключить проверку потоков
+    connect_args = {"check_same_thread": False} if "sqlite" in url else {}
+    # Параметр future=True включает новый API SQLAlchemy 2.0
+    return create_engine(url, connect_args=connect_args, future=True)
+
+
+def create_session_factory(bind: Engine) -> sessionmaker:
+    """
+    Создает фабрику сессий для указанного engine.
+
+    expire_on_commit=False: объекты, полученные через INSERT/UPDATE ... RETURNING, остаются
+    загруженными после commit() и не требуют повторного SELECT при сериализации ответа.
+    """
+    return sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=bind,
+        future=True
+    )
+
+
+def add_missing_columns(bind: Engine, table: Table) -> None:
+    """
+    Добавляет в существующую таблицу столбцы и индексы модели, которых в ней еще нет.
+
+    create_all не изменяет уже созданные таблицы, поэтому базы, созданные до появления
+    нового столбца, дополняются через ALTER TABLE ADD COLUMN. Подходит только для
+    столбцов, допускающих NULL.
+    """
+    existing = {column["name"] for column in inspect(bind).get_columns(table.name)}
+    with bind.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    for index in table.indexes:
+        index.create(bind, checkfirst=True)
+
+
+# Создаем объект engine основной базы
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 
 # Создаем SessionLocal - фабрику сессий с использованием нового API
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+SessionLocal = create_session_factory(engine)
 
 # Определяем базовый класс для моделей
 Base = declarative_base()
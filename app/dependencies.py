@@ -3,6 +3,7 @@ from fastapi import Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from .database import SessionLocal
 from .auth import oauth2_scheme, verify_token
+from .sharding import ShardRouter, get_router
 from .models import User  # Предполагается, что ваша модель пользователя называется User
 
 
@@ -40,6 +41,30 @@ def get_current_user(
     return verify_token(token, db)
 
 
+def get_shard_router() -> ShardRouter:
+    """
+    Зависимость для получения маршрутизатора шардов заметок.
+    """
+    return get_router()
+
+
+def get_notes_db(
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db),
+        router: ShardRouter = Depends(get_shard_router)
+) -> Generator[Session, None, None]:
+    """
+    Зависимость для получения сессии базы, в которой хранятся заметки текущего пользователя.
+
+    В режиме одной базы возвращает ту же сессию, что и get_db.
+
+    Возвращает:
+        Генератор сессий SQLAlchemy шарда текущего пользователя.
+    """
+    with router.session_for_owner(current_user.id, db) as notes_db:
+        yield notes_db
+
+
 def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """
     Зависимость для получения активного пользователя.
@@ -0,0 +1,274 @@
+"""
+Модуль событий изменения заметок и их доставки клиентам через Server-Sent Events.
+
+Эндпоинты создания, изменения, удаления и восстановления заметок после фиксации
+транзакции публикуют событие в EventBus. Шина передает его брокеру, а брокер — всем
+подписанным шинам (в одном процессе это та же шина). Каждое SSE-подключение получает
+собственную ограниченную очередь в цикле событий, поэтому не держит ни сессию базы,
+ни поток пула.
+
+Брокер подключается настройкой event_broker (путь вида "package.module.ClassName").
+LocalBroker доставляет события внутри процесса; межпроцессный брокер (например, на Redis)
+реализует тот же интерфейс Broker и сам назначает возрастающие ID событий.
+
+Использование:
+    events.publish_note("note.created", db_note)
+"""
+
+import asyncio
+import importlib
+import itertools
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from . import models, schemas
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Event:
+    """
+    Событие об изменении заметки.
+
+    Атрибуты:
+        id: Возрастающий идентификатор события (используется в Last-Event-ID).
+        user_id: Идентификатор пользователя, которому адресовано событие.
+        type: Тип события, например "note.updated".
+        data: Данные события в виде JSON-строки.
+    """
+
+    __slots__ = ("id", "user_id", "type", "data")
+
+    def __init__(self, id: int, user_id: int, type: str, data: str):
+        self.id = id
+        self.user_id = user_id
+        self.type = type
+        self.data = data
+
+    def encode(self) -> bytes:
+        """
+        Кодирует событие в формат text/event-stream.
+        """
+        return f"id: {self.id}\nevent: {self.type}\ndata: {self.data}\n\n".encode()
+
+    def __repr__(self) -> str:
+        return f"<Event(id={self.id}, user_id={self.user_id}, type='{self.type}')>"
+
+
+class Broker(ABC):
+    """
+    Интерфейс брокера, доставляющего события всем процессам приложения.
+    """
+
+    @abstractmethod
+    def publish(self, user_id: int, event_type: str, data: str) -> None:
+        """
+        Публикует событие. Брокер назначает событию ID и передает его всем слушателям.
+        """
+
+    @abstractmethod
+    def subscribe(self, listener: Callable[[Event], None]) -> None:
+        """
+        Регистрирует слушателя, который будет вызываться для каждого события.
+        """
+
+
+class LocalBroker(Broker):
+    """
+    Брокер в пределах одного процесса: передает события слушателям синхронно.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._listeners: List[Callable[[Event], None]] = []
+        self._lock = threading.Lock()
+
+    def publish(self, user_id: int, event_type: str, data: str) -> None:
+        with self._lock:
+            event = Event(next(self._ids), user_id, event_type, data)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(event)
+
+    def subscribe(self, listener: Callable[[Event], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+
+class Subscription:
+    """
+    Подписка одного SSE-подключения.
+
+    Очередь ограничена: если клиент не успевает читать и очередь переполняется,
+    она очищается, а вместо событий кладется None — сигнал отключить медленного клиента.
+    """
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def deliver(self, event: Event) -> None:
+        """
+        Кладет событие в очередь. Вызывается в цикле событий подписчика.
+        """
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventBus:
+    """
+    Внутрипроцессная шина событий: хранит подписки и недавнюю историю событий.
+    """
+
+    def __init__(self, broker: Broker, history_size: int = 1000, queue_size: int = 100):
+        self._broker = broker
+        self._queue_size = queue_size
+        self._history: Deque[Event] = deque(maxlen=history_size)
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        broker.subscribe(self._dispatch)
+
+    def publish(self, user_id: int, event_type: str, data: str) -> None:
+        """
+        Публикует событие для пользователя. Безопасно вызывать из любого потока.
+        """
+        self._broker.publish(user_id, event_type, data)
+
+    def _dispatch(self, event: Event) -> None:
+        with self._lock:
+            self._history.append(event)
+            subscriptions = list(self._subscriptions.get(event.user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт; подписка будет удалена при отключении.
+                pass
+
+    def subscribe(self, user_id: int, last_event_id: Optional[int] = None) -> Tuple[Subscription, List[Event], bool]:
+        """
+        Создает подписку в текущем цикле событий.
+
+        :param user_id: Идентификатор пользователя.
+        :param last_event_id: ID последнего полученного клиентом события (заголовок Last-Event-ID).
+        :return: Подписка, события для повторной отправки и флаг того, что часть событий
+                 уже вытеснена из истории и клиенту нужно перечитать заметки.
+        """
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self._queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            if last_event_id is None:
+                return subscription, [], False
+            replay = [e for e in self._history if e.id > last_event_id and e.user_id == user_id]
+            # Пропуск: нужные события вытеснены из истории либо ID неизвестен (перезапуск процесса).
+            gap = (
+                not self._history
+                or self._history[0].id > last_event_id + 1
+                or self._history[-1].id < last_event_id
+            )
+        return subscription, replay, gap
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Удаляет подписку.
+        """
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    async def stream(
+            self,
+            user_id: int,
+            last_event_id: Optional[int],
+            is_disconnected: Callable[[], Awaitable[bool]],
+            heartbeat: float
+    ) -> AsyncIterator[bytes]:
+        """
+        Генерирует поток text/event-stream для пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :param last_event_id: ID последнего полученного клиентом события.
+        :param is_disconnected: Корутина-функция, проверяющая отключение клиента.
+        :param heartbeat: Интервал комментариев-heartbeat в секундах.
+        """
+        subscription, replay, gap = self.subscribe(user_id, last_event_id)
+        try:
+            yield b"retry: 3000\n\n"
+            if gap:
+                yield b"event: reset\ndata: {}\n\n"
+            for event in replay:
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield b": heartbeat\n\n"
+                    continue
+                if event is None:
+                    logger.warning("SSE-клиент пользователя %s не успевает читать события и отключен", user_id)
+                    break
+                yield event.encode()
+        finally:
+            self.unsubscribe(subscription)
+
+
+def load_broker(path: str) -> Broker:
+    """
+    Создает брокер по пути вида "package.module.ClassName".
+    """
+    module_name, _, class_name = path.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+_bus: Optional[EventBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_event_bus() -> EventBus:
+    """
+    Возвращает общую шину событий, созданную по настройкам приложения.
+    """
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = EventBus(
+                load_broker(settings.event_broker),
+                history_size=settings.sse_history_size,
+                queue_size=settings.sse_queue_size,
+            )
+        return _bus
+
+
+def publish_note(event_type: str, note: models.Note) -> None:
+    """
+    Публикует событие об изменении заметки ее владельцу.
+
+    Вызывается после фиксации транзакции.
+
+    :param event_type: Тип события: note.created, note.updated, note.deleted или note.restored.
+    :param note: Объект заметки после изменения.
+    """
+    try:
+        data = schemas.NoteResponse.model_validate(note, from_attributes=True).model_dump_json()
+        get_event_bus().publish(note.owner_id, event_type, data)
+    except Exception as e:
+        # Изменение уже зафиксировано, поэтому ошибка доставки не должна приводить к ошибке запроса.
+        logger.error("Ошибка при публикации события %s для заметки с id %s: %s", event_type, note.id, e)
@@ -1,17 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Form, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 import logging
-from datetime import timedelta
-
-from . import models, schemas, crud, auth
-from .database import engine, Base
-from .dependencies import get_db, get_current_user, require_role
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+
+from . import models, schemas, crud, auth, batcher, blobstore, events, profiling
+from .database import engine, Base, add_missing_columns
+from .dependencies import get_db, get_current_user, get_notes_db, get_shard_router, require_role
+from .sharding import ShardRouter
 from .config import settings
 
 # Создаем все таблицы в базе данных, если они еще не существуют.
 # Замечание: для продакшн-приложения создание таблиц следует выполнять через миграции.
 Base.metadata.create_all(bind=engine)
+# Дополняем таблицы, созданные предыдущими версиями приложения, новыми столбцами.
+add_missing_columns(engine, models.Note.__table__)
 
 # Настройка логирования: все действия записываются в файл app.log.
 logging.basicConfig(
@@ -20,8 +27,21 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Жизненный цикл приложения: при остановке дописывает очередь WriteBatcher.
+    """
+    yield
+    batcher.shutdown_write_batcher()
+
+
 # Инициализируем экземпляр приложения FastAPI с названием.
-app = FastAPI(title="Notes API")
+app = FastAPI(title="Notes API", lifespan=lifespan)
+
+# Профилирование запросов по заголовку X-Profile (для администраторов) или по выборке.
+app.add_middleware(profiling.ProfilingMiddleware)
 
 
 # --- Эндпоинт для авторизации и получения JWT токена ---
@@ -59,8 +79,50 @@ def login_for_access_token(
     access_token = auth.create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
+    refresh_token = auth.issue_refresh_token(db, user.id)
     logging.info(f"Пользователь {user.username} вошёл в систему.")
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+@app.post("/token/refresh")
+def refresh_access_token(
+        refresh_token: str = Form(...),
+        db: Session = Depends(get_db)
+):
+    """
+    Обменивает refresh-токен на новую пару access- и refresh-токенов без проверки пароля.
+
+    Предъявленный refresh-токен гасится; его повторное использование отзывает всю цепочку.
+
+    Параметры:
+        refresh_token: Refresh-токен, полученный от /token или предыдущего /token/refresh.
+        db: Сессия базы данных.
+
+    Возвращает:
+        Словарь с access_token, refresh_token и типом токена.
+    """
+    user, new_refresh_token = auth.rotate_refresh_token(db, refresh_token)
+    access_token = auth.create_access_token(
+        data={"sub": user.username}, expires_delta=settings.access_token_expire
+    )
+    logging.info(f"Пользователь {user.username} обновил токен доступа.")
+    return {"access_token": access_token, "refresh_token": new_refresh_token, "token_type": "bearer"}
+
+
+@app.post("/token/revoke")
+def revoke_refresh_token(
+        refresh_token: str = Form(...),
+        db: Session = Depends(get_db)
+):
+    """
+    Отзывает цепочку ротаций, к которой принадлежит refresh-токен (выход из системы).
+
+    Возвращает:
+        Словарь с числом отозванных токенов.
+    """
+    revoked = crud.revoke_refresh_token_family_by_hash(db, auth.hash_refresh_token(refresh_token), datetime.utcnow())
+    logging.info(f"Отозвано refresh-токенов при выходе: {revoked}")
+    return {"revoked": revoked}
 
 
 # --- Эндпоинт для регистрации нового пользователя ---
@@ -81,18 +143,44 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return new_user
 
 
+def find_note(db: Session, router: ShardRouter, note_id: int) -> Optional[models.Note]:
+    """
+    Ищет заметку в шарде текущего пользователя, а при промахе — во всех шардах.
+    """
+    note = crud.get_note(db, note_id)
+    if note is None and router.distributed:
+        note = router.find_note(db, note_id)
+    return note
+
+
+def raise_note_access_error(db: Session, router: ShardRouter, note_id: int) -> None:
+    """
+    Выбрасывает 404 или 403 для мутации, условный запрос которой не затронул ни одной строки.
+
+    Вызывается только при промахе, поэтому успешные мутации обходятся одним запросом к базе.
+    """
+    note = find_note(db, router, note_id)
+    if note is None or note.is_deleted:
+        raise HTTPException(status_code=404, detail="Заметка не найдена")
+    raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+
 # ------------------- Эндпоинты для пользователей с ролью "User" -------------------
 
 @app.post("/notes/", response_model=schemas.NoteResponse)
 def create_note(
         note: schemas.NoteCreate,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_notes_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
     Создает новую заметку для текущего пользователя.
     """
-    db_note = crud.create_note(db, note, current_user.id)
+    # Большой текст сохраняется в хранилище здесь, а не в потоке-писателе WriteBatcher.
+    values = crud.prepare_note_values(note)
+    db_note = batcher.execute(db, crud.create_note, values, current_user.id, router.allocate_note_id())
+    events.publish_note("note.created", db_note)
     logging.info(f"Пользователь {current_user.username} с ролью {current_user.role} создал заметку с ID {db_note.id}")
     return db_note
 
@@ -100,7 +188,7 @@ def create_note(
 @app.get("/notes/", response_model=list[schemas.NoteResponse])
 def read_notes(
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_notes_db)
 ):
     """
     Возвращает список заметок, принадлежащих текущему пользователю.
@@ -110,17 +198,42 @@ def read_notes(
     return notes
 
 
+@app.get("/notes/events")
+async def note_events(
+        request: Request,
+        token: str = Depends(auth.oauth2_scheme),
+        last_event_id: Optional[int] = Header(None, alias="Last-Event-ID")
+):
+    """
+    Поток Server-Sent Events с изменениями заметок текущего пользователя.
+
+    Токен проверяется в короткоживущей сессии, после чего подключение не удерживает
+    ни сессию базы, ни поток пула. Поддерживаются heartbeat-комментарии, отключение
+    медленных клиентов и возобновление по заголовку Last-Event-ID.
+    """
+    current_user = await run_in_threadpool(auth.authenticate_token, token)
+    logging.info(f"Пользователь {current_user.username} подписался на события заметок")
+    return StreamingResponse(
+        events.get_event_bus().stream(
+            current_user.id, last_event_id, request.is_disconnected, settings.sse_heartbeat_seconds
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/notes/{note_id}", response_model=schemas.NoteResponse)
 def read_note(
         note_id: int,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_notes_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
     Возвращает конкретную заметку по ID.
     Доступ разрешен, если заметка принадлежит пользователю или пользователь — Admin.
     """
-    note = crud.get_note(db, note_id)
+    note = find_note(db, router, note_id)
     if note is None or note.is_deleted:
         raise HTTPException(status_code=404, detail="Заметка не найдена")
     if note.owner_id != current_user.id and current_user.role != "Admin":
@@ -129,22 +242,50 @@ def read_note(
     return note
 
 
+@app.get("/notes/{note_id}/body")
+def read_note_body(
+        note_id: int,
+        current_user: models.User = Depends(get_current_user),
+        db: Session = Depends(get_notes_db),
+        router: ShardRouter = Depends(get_shard_router)
+):
+    """
+    Возвращает текст заметки как text/plain с теми же правилами доступа, что и у /notes/{note_id}.
+
+    Текст, вынесенный в хранилище, отдается файлом (sendfile) с поддержкой
+    заголовка Range; ETag совпадает с хэшем содержимого.
+    """
+    note = find_note(db, router, note_id)
+    if note is None or note.is_deleted:
+        raise HTTPException(status_code=404, detail="Заметка не найдена")
+    if note.owner_id != current_user.id and current_user.role != "Admin":
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    logging.info(f"Пользователь {current_user.username} запросил текст заметки с ID {note_id}")
+    if note.body_ref is None:
+        return PlainTextResponse(note.body)
+    path = blobstore.get_blob_store().path(note.body_ref)
+    if path is None:
+        logging.error(f"Файл текста {note.body_ref} заметки с ID {note_id} отсутствует в хранилище")
+        raise HTTPException(status_code=404, detail="Текст заметки не найден")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", headers={"ETag": f'"{note.body_ref}"'})
+
+
 @app.put("/notes/{note_id}", response_model=schemas.NoteResponse)
 def update_note(
         note_id: int,
         note_update: schemas.NoteUpdate,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_notes_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
     Обновляет заметку, если она принадлежит текущему пользователю.
     """
-    note = crud.get_note(db, note_id)
-    if note is None or note.is_deleted:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
-    if note.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Недостаточно прав")
-    updated_note = crud.update_note(db, note, note_update)
+    values = crud.prepare_note_values(note_update)
+    updated_note = batcher.execute(db, crud.update_note, note_id, current_user.id, values)
+    if updated_note is None:
+        raise_note_access_error(db, router, note_id)
+    events.publish_note("note.updated", updated_note)
     logging.info(f"Пользователь {current_user.username} обновил заметку с ID {note_id}")
     return updated_note
 
@@ -153,17 +294,16 @@ def update_note(
 def delete_note(
         note_id: int,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_notes_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
     Мягко удаляет заметку, устанавливая флаг is_deleted в True.
     """
-    note = crud.get_note(db, note_id)
-    if note is None or note.is_deleted:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
-    if note.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Недостаточно прав")
-    deleted_note = crud.delete_note(db, note)
+    deleted_note = batcher.execute(db, crud.delete_note, note_id, current_user.id)
+    if deleted_note is None:
+        raise_note_access_error(db, router, note_id)
+    events.publish_note("note.deleted", deleted_note)
     logging.info(f"Пользователь {current_user.username} удалил заметку с ID {note_id}")
     return deleted_note
 
@@ -172,13 +312,17 @@ def delete_note(
 
 @app.get("/admin/notes/", response_model=list[schemas.NoteResponse])
 def admin_get_all_notes(
+        skip: int = 0,
+        limit: Optional[int] = None,
         current_user: models.User = Depends(require_role("Admin")),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
-    Для администратора: возвращает список всех заметок, не удаленных.
+    Для администратора: возвращает список всех заметок, не удаленных, упорядоченный по ID.
+    При шардировании шарды опрашиваются параллельно, а страницы объединяются.
     """
-    notes = crud.get_all_notes(db)
+    notes = router.get_all_notes(db, skip, limit)
     logging.info(f"Админ {current_user.username} запросил список всех заметок")
     return notes
 
@@ -187,12 +331,14 @@ def admin_get_all_notes(
 def admin_get_notes_by_user(
         user_id: int,
         current_user: models.User = Depends(require_role("Admin")),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
     Для администратора: возвращает список заметок конкретного пользователя.
     """
-    notes = crud.get_notes_by_user(db, user_id)
+    with router.session_for_owner(user_id, db) as notes_db:
+        notes = crud.get_notes_by_user(notes_db, user_id)
     logging.info(f"Админ {current_user.username} запросил заметки пользователя с ID {user_id}")
     return notes
 
@@ -201,21 +347,68 @@ def admin_get_notes_by_user(
 def admin_restore_note(
         note_id: int,
         current_user: models.User = Depends(require_role("Admin")),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        router: ShardRouter = Depends(get_shard_router)
 ):
     """
     Для администратора: восстанавливает ранее удаленную заметку.
     """
-    note = crud.get_note(db, note_id)
-    if note is None:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
-    if not note.is_deleted:
-        raise HTTPException(status_code=400, detail="Заметка не удалена")
-    restored_note = crud.restore_note(db, note)
+    with router.session_for_note(db, note_id) as notes_db:
+        if notes_db is None:
+            raise HTTPException(status_code=404, detail="Заметка не найдена")
+        restored_note = batcher.execute(notes_db, crud.restore_note, note_id)
+        if restored_note is None:
+            # Условный UPDATE не затронул строк: выясняем причину только в этом случае.
+            if crud.get_note(notes_db, note_id) is None:
+                raise HTTPException(status_code=404, detail="Заметка не найдена")
+            raise HTTPException(status_code=400, detail="Заметка не удалена")
+    events.publish_note("note.restored", restored_note)
     logging.info(f"Админ {current_user.username} восстановил заметку с ID {note_id}")
     return restored_note
 
 
+@app.post("/admin/users/{user_id}/revoke-tokens")
+def admin_revoke_user_tokens(
+        user_id: int,
+        current_user: models.User = Depends(require_role("Admin")),
+        db: Session = Depends(get_db)
+):
+    """
+    Для администратора: отзывает все refresh-токены пользователя.
+
+    Уже выданные access-токены продолжают действовать до истечения, поэтому доступ
+    пользователя прекращается не позднее чем через access_token_expire_minutes.
+    """
+    revoked = crud.revoke_user_refresh_tokens(db, user_id, datetime.utcnow())
+    logging.info(f"Админ {current_user.username} отозвал {revoked} refresh-токенов пользователя с ID {user_id}")
+    return {"revoked": revoked}
+
+
+@app.get("/admin/profiles", response_model=list[schemas.ProfileSummary])
+def admin_list_profiles(current_user: models.User = Depends(require_role("Admin"))):
+    """
+    Для администратора: возвращает список сохраненных снимков профилирования, новые первыми.
+    """
+    profiles = profiling.get_profile_store().list()
+    logging.info(f"Админ {current_user.username} запросил список профилей")
+    return profiles
+
+
+@app.get("/admin/profiles/{capture_id}")
+def admin_download_profile(
+        capture_id: str,
+        current_user: models.User = Depends(require_role("Admin"))
+):
+    """
+    Для администратора: отдает снимок профилирования (стеки и SQL-запросы) в виде JSON-файла.
+    """
+    path = profiling.get_profile_store().path(capture_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    logging.info(f"Админ {current_user.username} скачал профиль {capture_id}")
+    return FileResponse(path, media_type="application/json", filename=f"profile-{capture_id}.json")
+
+
 # Запуск приложения через uvicorn (если файл запускается напрямую)
 if __name__ == "__main__":
     import uvicorn
@@ -39,7 +39,8 @@ class Note(Base):
     Атрибуты:
         id: Уникальный идентификатор заметки.
         title: Заголовок заметки.
-        body: Текст заметки.
+        body: Текст заметки; пустая строка, если текст вынесен в хранилище (см. body_ref).
+        body_ref: SHA-256 текста в хранилище app.blobstore или None, если текст хранится в таблице.
         owner_id: Внешний ключ, указывающий на пользователя, создавшего заметку.
         is_deleted: Флаг мягкого удаления заметки.
         created_at: Дата и время создания заметки.
@@ -51,6 +52,7 @@ class Note(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(256), nullable=False)
     body = Column(String(65536), nullable=False)
+    body_ref = Column(String(64), nullable=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     is_deleted = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -63,3 +65,73 @@ class Note(Base):
         # Ограничиваем длину заголовка для вывода, чтобы не перегружать консоль
         title_preview = self.title if len(self.title) <= 20 else self.title[:17] + "..."
         return f"<Note(id={self.id}, title='{title_preview}', owner_id={self.owner_id}, is_deleted={self.is_deleted})>"
+
+
+class UserShard(Base):
+    """
+    Модель закрепления пользователя за шардом (таблица 'user_shards', основная база).
+
+    Заполняется инструментом перебалансировки. Пользователи без записи в этой таблице
+    размещаются по стабильному хэшу своего ID.
+
+    Атрибуты:
+        user_id: Идентификатор пользователя.
+        shard: Номер шарда, в котором хранятся заметки пользователя.
+    """
+    __tablename__ = "user_shards"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<UserShard(user_id={self.user_id}, shard={self.shard})>"
+
+
+class IdSequence(Base):
+    """
+    Модель глобального счетчика идентификаторов (таблица 'id_sequences', основная база).
+
+    При шардировании ID заметок выдаются блоками из этого счетчика, чтобы они
+    оставались уникальными во всех шардах и не менялись при переносе заметок.
+
+    Атрибуты:
+        name: Имя последовательности (например, "notes").
+        next_value: Первое значение, еще не выданное ни одному процессу.
+    """
+    __tablename__ = "id_sequences"
+
+    name = Column(String(50), primary_key=True)
+    next_value = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<IdSequence(name='{self.name}', next_value={self.next_value})>"
+
+
+class RefreshToken(Base):
+    """
+    Модель refresh-токена (таблица 'refresh_tokens', основная база).
+
+    Хранится только SHA-256 хэш токена. Токены одной цепочки ротаций имеют общий family_id:
+    повторное предъявление уже использованного токена отзывает всю цепочку.
+
+    Атрибуты:
+        id: Уникальный идентификатор записи.
+        user_id: Идентификатор пользователя, которому выдан токен.
+        token_hash: SHA-256 хэш токена в шестнадцатеричном виде.
+        family_id: Идентификатор цепочки ротаций, начатой одним входом по паролю.
+        created_at: Дата и время выдачи токена.
+        expires_at: Дата и время истечения токена.
+        revoked_at: Дата и время отзыва или использования токена (None, если токен активен).
+    """
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    family_id = Column(String(32), index=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<RefreshToken(id={self.id}, user_id={self.user_id}, family_id='{self.family_id}')>"
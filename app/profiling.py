@@ -0,0 +1,346 @@
+"""
+Модуль профилирования отдельных запросов по требованию.
+
+ProfilingMiddleware профилирует запрос, если:
+- администратор передал заголовок X-Profile: 1 (токен проверяется только при наличии заголовка);
+- либо запрос выбран случайно с вероятностью profile_sample_rate.
+
+Профилирование выполняет сэмплирующий профайлер: отдельный поток с интервалом
+profile_sample_interval_ms снимает стеки потоков, выполняющих запрос, и сворачивает их
+в формат collapsed stacks (совместим с flamegraph.pl и speedscope). Поток пула
+учитывается только на время выполнения синхронного кода этого запроса (зависимостей
+и обработчика), а поток цикла событий — только пока в нем выполняется задача запроса,
+поэтому стеки конкурентных запросов других пользователей в снимок не попадают.
+Вместе со стеками сохраняются все SQL-запросы с временем выполнения. Параметры запросов
+не сохраняются: в них хэши паролей, токенов и тексты заметок других пользователей.
+
+Результаты хранятся в profile_dir как JSON-файлы; хранится не более profile_max_captures
+последних снимков. Номер снимка возвращается в заголовке ответа X-Profile-Id.
+Запросы без триггера проходят через middleware без дополнительной работы. Обработчики
+событий SQLAlchemy и обертка anyio.to_thread.run_sync (через нее FastAPI вызывает
+синхронный код) подключаются, пока выполняется хотя бы одно профилирование, и
+отключаются после его завершения.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio.to_thread
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import auth
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Формат ID снимка: время начала запроса и случайный суффикс; сортируется по времени.
+CAPTURE_ID_PATTERN = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{8}$")
+
+_current_capture: ContextVar[Optional["Capture"]] = ContextVar("current_capture", default=None)
+
+
+class Capture:
+    """
+    Данные профилирования одного запроса.
+    """
+
+    def __init__(self, method: str, path: str, trigger: str, interval: float):
+        started = datetime.utcnow()
+        self.id = f"{started.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = started
+        self.interval = interval
+        self.status: Optional[int] = None
+        self.duration_ms = 0.0
+        self._started = 0.0
+        # Потоки пула, выполняющие код этого запроса, с числом вложенных вызовов.
+        self.threads: Counter = Counter()
+        self._threads_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop_thread: Optional[int] = None
+        self.samples: Counter = Counter()
+        self.statements: List[Dict[str, Any]] = []
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.id}", daemon=True)
+
+    def start(self) -> None:
+        """
+        Запускает профилирование. Вызывается из задачи запроса в цикле событий.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._loop_thread = threading.get_ident()
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self._stop.set()
+        self._sampler.join()
+
+    def wrap(self, func: Callable) -> Callable:
+        """
+        Оборачивает функцию, выполняемую в пуле потоков, так, чтобы поток учитывался
+        профайлером только на время ее выполнения.
+        """
+        def run(*args, **kwargs):
+            thread_id = threading.get_ident()
+            with self._threads_lock:
+                self.threads[thread_id] += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._threads_lock:
+                    self.threads[thread_id] -= 1
+                    if not self.threads[thread_id]:
+                        del self.threads[thread_id]
+
+        return run
+
+    def _active_threads(self) -> List[int]:
+        with self._threads_lock:
+            thread_ids = list(self.threads)
+        if self._task is not None and asyncio.current_task(self._loop) is self._task:
+            thread_ids.append(self._loop_thread)
+        return thread_ids
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            thread_ids = self._active_threads()
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[fold_stack(frame)] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "sample_interval_ms": self.interval * 1000,
+            "samples": dict(self.samples.most_common()),
+            "statements": self.statements,
+        }
+
+
+def fold_stack(frame) -> str:
+    """
+    Сворачивает стек в строку "внешний;...;внутренний" (формат collapsed stacks).
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_capture.get() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    capture = _current_capture.get()
+    if capture is not None:
+        started = getattr(context, "_profile_started", time.perf_counter())
+        capture.statements.append({
+            "sql": statement,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        })
+
+
+_original_run_sync = anyio.to_thread.run_sync
+
+
+async def _run_sync(func, *args, **kwargs):
+    """
+    Замена anyio.to_thread.run_sync на время профилирования: код профилируемого
+    запроса выполняется в пуле через Capture.wrap, остальные вызовы передаются как есть.
+    """
+    capture = _current_capture.get()
+    if capture is not None:
+        func = capture.wrap(func)
+    return await _original_run_sync(func, *args, **kwargs)
+
+
+_active_captures = 0
+_hooks_lock = threading.Lock()
+
+
+def _acquire_hooks() -> None:
+    """
+    Подключает обработчики SQL-событий и обертку пула потоков при первом активном профилировании.
+    """
+    global _active_captures
+    with _hooks_lock:
+        if _active_captures == 0:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            anyio.to_thread.run_sync = _run_sync
+        _active_captures += 1
+
+
+def _release_hooks() -> None:
+    """
+    Отключает обработчики после завершения последнего активного профилирования,
+    чтобы запросы без профилирования не выполняли лишнего кода на каждый SQL-запрос.
+    """
+    global _active_captures
+    with _hooks_lock:
+        _active_captures -= 1
+        if _active_captures == 0:
+            event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+            anyio.to_thread.run_sync = _original_run_sync
+
+
+class ProfileStore:
+    """
+    Кольцевое хранилище снимков профилирования на диске.
+    """
+
+    def __init__(self, directory: str, max_captures: int):
+        self.directory = directory
+        self.max_captures = max(1, max_captures)
+
+    def path(self, capture_id: str) -> Optional[str]:
+        """
+        Возвращает путь к файлу снимка или None, если ID некорректен или снимок не найден.
+        """
+        if not CAPTURE_ID_PATTERN.match(capture_id):
+            return None
+        path = os.path.join(self.directory, f"{capture_id}.json")
+        return path if os.path.isfile(path) else None
+
+    def save(self, capture: Capture) -> None:
+        """
+        Сохраняет снимок и удаляет самые старые, если их больше max_captures.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{capture.id}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(capture.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        for capture_id in self.list_ids()[:-self.max_captures]:
+            try:
+                os.remove(os.path.join(self.directory, f"{capture_id}.json"))
+            except FileNotFoundError:
+                pass
+
+    def list_ids(self) -> List[str]:
+        """
+        Возвращает ID сохраненных снимков от старых к новым.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        names = (name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+        return sorted(name for name in names if CAPTURE_ID_PATTERN.match(name))
+
+    def list(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает краткие сведения о снимках от новых к старым.
+        """
+        summaries = []
+        for capture_id in reversed(self.list_ids()):
+            try:
+                with open(os.path.join(self.directory, f"{capture_id}.json"), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            data["statement_count"] = len(data.pop("statements"))
+            data["sample_count"] = sum(data.pop("samples").values())
+            summaries.append(data)
+        return summaries
+
+
+def get_profile_store() -> ProfileStore:
+    """
+    Возвращает хранилище снимков, настроенное по параметрам приложения.
+    """
+    return ProfileStore(settings.profile_dir, settings.profile_max_captures)
+
+
+def _is_admin(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        return auth.authenticate_token(token).role == "Admin"
+    except HTTPException:
+        return False
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware, профилирующее запросы по заголовку X-Profile или по выборке.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def _trigger(self, scope) -> Optional[str]:
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1":
+            authorization = headers.get(b"authorization", b"").decode("latin-1")
+            if await run_in_threadpool(_is_admin, authorization):
+                return "header"
+        rate = settings.profile_sample_rate
+        if rate > 0 and random.random() < rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trigger = await self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        capture = Capture(scope["method"], scope["path"], trigger, settings.profile_sample_interval_ms / 1000)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", capture.id.encode())]
+            await send(message)
+
+        _acquire_hooks()
+        token = _current_capture.set(capture)
+        capture.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            capture.stop()
+            _current_capture.reset(token)
+            _release_hooks()
+            try:
+                await run_in_threadpool(get_profile_store().save, capture)
+            except OSError as e:
+                logger.error("Ошибка при сохранении профиля %s: %s", capture.id, e)
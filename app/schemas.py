@@ -67,6 +67,10 @@ class NoteResponse(NoteBase):
     Схема для возврата данных заметки через API.
     """
     id: int = Field(..., title="Note ID", description="Уникальный идентификатор заметки")
+    body_ref: Optional[str] = Field(
+        None, title="Body Ref",
+        description="Хэш текста, вынесенного в хранилище; в этом случае body пуст, а текст отдает /notes/{id}/body"
+    )
     owner_id: int = Field(..., title="Owner ID", description="Идентификатор пользователя, создавшего заметку")
     is_deleted: bool = Field(..., title="Is Deleted", description="Флаг мягкого удаления заметки")
     created_at: datetime = Field(..., title="Created At", description="Дата и время создания заметки")
@@ -74,3 +78,20 @@ class NoteResponse(NoteBase):
 
     class Config:
         orm_mode = True
+
+
+# ---- Схемы для профилирования ----
+
+class ProfileSummary(BaseModel):
+    """
+    Схема кратких сведений о снимке профилирования запроса.
+    """
+    id: str = Field(..., title="Profile ID", description="Идентификатор снимка")
+    method: str = Field(..., title="Method", description="HTTP-метод запроса")
+    path: str = Field(..., title="Path", description="Путь запроса")
+    status: Optional[int] = Field(None, title="Status", description="HTTP-статус ответа")
+    trigger: str = Field(..., title="Trigger", description="Причина профилирования: header или sample")
+    started_at: datetime = Field(..., title="Started At", description="Время начала запроса")
+    duration_ms: float = Field(..., title="Duration", description="Длительность запроса в миллисекундах")
+    statement_count: int = Field(..., title="Statement Count", description="Число выполненных SQL-запросов")
+    sample_count: int = Field(..., title="Sample Count", description="Число снятых стеков")
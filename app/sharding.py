@@ -0,0 +1,484 @@
+"""
+Модуль шардирования заметок по владельцу.
+
+Пользователи, токены и служебные таблицы остаются в основной базе (каталоге), а заметки
+распределяются по N базам-шардам из настройки shard_database_urls. Шард пользователя
+определяется стабильным хэшем owner_id либо явным закреплением в таблице user_shards,
+которое записывает инструмент перебалансировки.
+
+При пустом списке шардов ShardRouter работает в режиме одной базы: все операции
+выполняются в сессии запроса, как и раньше.
+
+Таблица заметок в шардах создается без внешнего ключа owner_id -> users.id: таблица
+users находится в другой базе. Ссылочную целостность поддерживает приложение: заметки
+создаются только для аутентифицированного пользователя, а пользователи не удаляются.
+
+ID заметок при шардировании выдаются блоками из глобального счетчика в каталоге,
+поэтому они уникальны во всех шардах и сохраняются при переносе заметок.
+
+Перенос заметок, созданных в основной базе до включения шардирования, в шарды владельцев:
+    python -m app.sharding import-directory
+
+Перенос заметок пользователя в другой шард:
+    python -m app.sharding move --user-id 42 --shard 1
+
+Шард по хэшу зависит от числа шардов, поэтому после изменения shard_database_urls
+заметки большинства пользователей оказываются не в том шарде, который для них вычисляется.
+Перенести их в шарды, определяемые новым списком (записи на время переноса должны быть
+остановлены):
+    python -m app.sharding rebalance
+"""
+
+import argparse
+import heapq
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from sqlalchemy import Column, MetaData, Table, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import crud, models
+from .config import settings
+from .database import Base, SessionLocal, engine, add_missing_columns, create_db_engine, create_session_factory
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Имя последовательности ID заметок в таблице id_sequences.
+NOTE_ID_SEQUENCE = "notes"
+
+
+def stable_shard(owner_id: int, shard_count: int) -> int:
+    """
+    Возвращает номер шарда по стабильному (не зависящему от процесса) хэшу owner_id.
+    """
+    return zlib.crc32(str(owner_id).encode()) % shard_count
+
+
+class ShardRouter:
+    """
+    Маршрутизатор операций с заметками по шардам.
+
+    Атрибуты:
+        directory: Фабрика сессий основной базы (пользователи, закрепления, счетчики ID).
+        shards: Фабрики сессий баз-шардов. Пустой список — режим одной базы.
+    """
+
+    def __init__(self, directory: sessionmaker, shards: Sequence[sessionmaker] = (), id_block_size: int = 1000):
+        self.directory = directory
+        self.shards = list(shards)
+        self._id_block_size = max(1, id_block_size)
+        self._id_lock = threading.Lock()
+        self._next_id = 0
+        self._id_limit = 0
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard") if self.shards else None
+
+    @property
+    def distributed(self) -> bool:
+        """
+        True, если заметки вынесены в отдельные базы-шарды.
+        """
+        return bool(self.shards)
+
+    def shard_for(self, owner_id: int, db: Session) -> int:
+        """
+        Определяет шард, в котором хранятся заметки пользователя.
+
+        :param owner_id: Идентификатор владельца заметок.
+        :param db: Сессия основной базы (для проверки явного закрепления).
+        :return: Номер шарда.
+        """
+        if not self.distributed:
+            return 0
+        pinned = crud.get_user_shard(db, owner_id)
+        if pinned is not None:
+            if 0 <= pinned < len(self.shards):
+                return pinned
+            # Список шардов сократился: закрепление указывает на удаленный шард.
+            logger.error("Пользователь %s закреплен за несуществующим шардом %s, используется шард по хэшу",
+                         owner_id, pinned)
+        return stable_shard(owner_id, len(self.shards))
+
+    @contextmanager
+    def session_for_owner(self, owner_id: int, db: Session) -> Iterator[Session]:
+        """
+        Открывает сессию шарда, в котором хранятся заметки пользователя.
+
+        В режиме одной базы возвращает переданную сессию основной базы.
+
+        :param owner_id: Идентификатор владельца заметок.
+        :param db: Сессия основной базы.
+        """
+        if not self.distributed:
+            yield db
+            return
+        notes_db = self.shards[self.shard_for(owner_id, db)]()
+        try:
+            yield notes_db
+        finally:
+            notes_db.close()
+
+    def fan_out(self, fn: Callable[[Session], T]) -> List[T]:
+        """
+        Параллельно выполняет fn(session) в каждом шарде, каждая со своей сессией.
+
+        В режиме одной базы fn выполняется один раз в новой сессии основной базы.
+
+        :return: Результаты в порядке номеров шардов.
+        """
+        def run(factory: sessionmaker) -> T:
+            db = factory()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        if not self.distributed:
+            return [run(self.directory)]
+        return list(self._executor.map(run, self.shards))
+
+    def find_note(self, db: Session, note_id: int) -> Optional[models.Note]:
+        """
+        Ищет заметку по ID во всех шардах.
+
+        :param db: Сессия, в которой искать в режиме одной базы.
+        :param note_id: ID заметки.
+        :return: Объект заметки или None.
+        """
+        if not self.distributed:
+            return crud.get_note(db, note_id)
+        return next((note for note in self.fan_out(lambda s: crud.get_note(s, note_id)) if note), None)
+
+    @contextmanager
+    def session_for_note(self, db: Session, note_id: int) -> Iterator[Optional[Session]]:
+        """
+        Открывает сессию шарда, содержащего заметку.
+
+        :param db: Сессия основной базы.
+        :param note_id: ID заметки.
+        :return: Сессия шарда или None, если заметка не найдена ни в одном шарде.
+        """
+        if not self.distributed:
+            yield db
+            return
+        note = self.find_note(db, note_id)
+        if note is None:
+            yield None
+            return
+        with self.session_for_owner(note.owner_id, db) as notes_db:
+            yield notes_db
+
+    def get_all_notes(self, db: Session, skip: int = 0, limit: Optional[int] = None) -> List[models.Note]:
+        """
+        Возвращает страницу всех не удаленных заметок, объединяя шарды по возрастанию ID.
+
+        Каждый шард отдает не более skip + limit первых заметок, затем списки сливаются.
+
+        :param db: Сессия, в которой читать в режиме одной базы.
+        :param skip: Число пропускаемых заметок.
+        :param limit: Максимальное число заметок; None — без ограничения.
+        """
+        if not self.distributed:
+            return crud.get_all_notes(db, skip, limit)
+        per_shard = None if limit is None else skip + limit
+        pages = self.fan_out(lambda s: crud.get_all_notes(s, 0, per_shard))
+        merged = list(heapq.merge(*pages, key=lambda note: note.id))
+        return merged[skip:] if limit is None else merged[skip:skip + limit]
+
+    def allocate_note_id(self) -> Optional[int]:
+        """
+        Выделяет глобально уникальный ID заметки.
+
+        :return: ID заметки или None в режиме одной базы (ID назначает автоинкремент).
+        """
+        if not self.distributed:
+            return None
+        with self._id_lock:
+            if self._next_id >= self._id_limit:
+                self._next_id, self._id_limit = self._reserve_id_block()
+            note_id = self._next_id
+            self._next_id += 1
+            return note_id
+
+    def _reserve_id_block(self) -> Tuple[int, int]:
+        """
+        Резервирует в каталоге блок ID [start, end) одним UPDATE ... RETURNING.
+        """
+        size = self._id_block_size
+        stmt = (
+            update(models.IdSequence)
+            .where(models.IdSequence.name == NOTE_ID_SEQUENCE)
+            .values(next_value=models.IdSequence.next_value + size)
+            .returning(models.IdSequence.next_value)
+        )
+        db = self.directory()
+        try:
+            while True:
+                end = db.scalar(stmt)
+                if end is not None:
+                    db.commit()
+                    return end - size, end
+                db.rollback()
+                # Первое обращение: продолжаем нумерацию после уже существующих заметок.
+                start = max([crud.get_max_note_id(db)] + self.fan_out(crud.get_max_note_id)) + 1
+                try:
+                    db.add(models.IdSequence(name=NOTE_ID_SEQUENCE, next_value=start + size))
+                    db.commit()
+                    return start, start + size
+                except IntegrityError:
+                    # Счетчик одновременно создал другой процесс — резервируем блок из него.
+                    db.rollback()
+        finally:
+            db.close()
+
+    def import_directory_notes(self, batch_size: int = 500) -> int:
+        """
+        Переносит заметки из основной базы в шарды их владельцев.
+
+        Нужен один раз после включения шардирования: заметки, созданные в режиме одной
+        базы, иначе недоступны. Заметки переносятся пачками по ID: копирование в шард
+        (с предварительным удалением тех же ID), затем удаление из основной базы.
+        Повторный запуск после сбоя безопасен. Записи на время переноса должны быть остановлены.
+
+        :param batch_size: Число заметок, переносимых за одну итерацию.
+        :return: Число перенесенных заметок.
+        """
+        if not self.distributed:
+            raise ValueError("Шардирование не настроено")
+
+        columns = models.Note.__table__.columns
+        directory_db = self.directory()
+        shard_of_owner = {}
+        imported = 0
+        try:
+            while True:
+                notes = directory_db.scalars(
+                    select(models.Note).order_by(models.Note.id).limit(batch_size)
+                ).all()
+                if not notes:
+                    break
+                rows_by_shard = {}
+                for note in notes:
+                    if note.owner_id not in shard_of_owner:
+                        shard_of_owner[note.owner_id] = self.shard_for(note.owner_id, directory_db)
+                    rows_by_shard.setdefault(shard_of_owner[note.owner_id], []).append(
+                        {column.key: getattr(note, column.key) for column in columns}
+                    )
+                for shard, rows in rows_by_shard.items():
+                    shard_db = self.shards[shard]()
+                    try:
+                        shard_db.execute(delete(models.Note).where(models.Note.id.in_([row["id"] for row in rows])))
+                        shard_db.execute(insert(models.Note), rows)
+                        shard_db.commit()
+                    except Exception:
+                        shard_db.rollback()
+                        raise
+                    finally:
+                        shard_db.close()
+                directory_db.execute(delete(models.Note).where(models.Note.id.in_([note.id for note in notes])))
+                directory_db.commit()
+                imported += len(notes)
+            logger.info("Из основной базы в шарды перенесено заметок: %s", imported)
+            return imported
+        finally:
+            directory_db.close()
+
+    def move_user(self, user_id: int, target: int) -> int:
+        """
+        Переносит все заметки пользователя в указанный шард и закрепляет его за ним.
+
+        Порядок: копирование в целевой шард, закрепление в каталоге, удаление из исходного.
+        Повторный запуск после сбоя безопасен. Записи пользователя на время переноса
+        должны быть остановлены.
+
+        :param user_id: Идентификатор пользователя.
+        :param target: Номер целевого шарда.
+        :return: Число перенесенных заметок.
+        """
+        if not self.distributed:
+            raise ValueError("Шардирование не настроено")
+        if not 0 <= target < len(self.shards):
+            raise ValueError(f"Шард {target} не существует")
+
+        directory_db = self.directory()
+        try:
+            source = self.shard_for(user_id, directory_db)
+            if source == target:
+                crud.set_user_shard(directory_db, user_id, target)
+                return 0
+            note_ids = self._copy_user_notes(user_id, source, target)
+            crud.set_user_shard(directory_db, user_id, target)
+            self._delete_notes(source, note_ids)
+        finally:
+            directory_db.close()
+        logger.info("Заметки пользователя %s (%s шт.) перенесены из шарда %s в шард %s",
+                    user_id, len(note_ids), source, target)
+        return len(note_ids)
+
+    def rebalance(self) -> int:
+        """
+        Переносит заметки, лежащие не в том шарде, который вычисляется для владельца.
+
+        Нужен после изменения списка шардов: шард по хэшу зависит от их числа. Шарды
+        обходятся целиком, поэтому находятся и заметки, оставшиеся после прерванного
+        переноса. Закрепленные пользователи переносятся в шард закрепления. Повторный
+        запуск после сбоя безопасен. Записи на время переноса должны быть остановлены.
+
+        :return: Число перенесенных заметок.
+        """
+        if not self.distributed:
+            raise ValueError("Шардирование не настроено")
+
+        owners_by_shard = self.fan_out(crud.get_note_owner_ids)
+        directory_db = self.directory()
+        moved = 0
+        try:
+            for source, owner_ids in enumerate(owners_by_shard):
+                for owner_id in owner_ids:
+                    target = self.shard_for(owner_id, directory_db)
+                    if target == source:
+                        continue
+                    note_ids = self._copy_user_notes(owner_id, source, target)
+                    self._delete_notes(source, note_ids)
+                    moved += len(note_ids)
+        finally:
+            directory_db.close()
+        logger.info("При перебалансировке шардов перенесено заметок: %s", moved)
+        return moved
+
+    def _copy_user_notes(self, user_id: int, source: int, target: int) -> List[int]:
+        """
+        Копирует заметки пользователя из шарда source в шард target.
+
+        Заметки с теми же ID в целевом шарде предварительно удаляются, поэтому повторное
+        копирование после сбоя безопасно, а заметки, уже созданные в целевом шарде, сохраняются.
+
+        :return: ID скопированных заметок.
+        """
+        source_db = self.shards[source]()
+        target_db = self.shards[target]()
+        try:
+            columns = models.Note.__table__.columns
+            rows = [
+                {column.key: getattr(note, column.key) for column in columns}
+                for note in crud.get_notes_by_user(source_db, user_id)
+            ]
+            note_ids = [row["id"] for row in rows]
+            if rows:
+                try:
+                    target_db.execute(delete(models.Note).where(models.Note.id.in_(note_ids)))
+                    target_db.execute(insert(models.Note), rows)
+                    target_db.commit()
+                except Exception:
+                    target_db.rollback()
+                    raise
+            return note_ids
+        finally:
+            source_db.close()
+            target_db.close()
+
+    def _delete_notes(self, shard: int, note_ids: List[int]) -> None:
+        """
+        Удаляет заметки с указанными ID из шарда.
+        """
+        if not note_ids:
+            return
+        db = self.shards[shard]()
+        try:
+            db.execute(delete(models.Note).where(models.Note.id.in_(note_ids)))
+            db.commit()
+        finally:
+            db.close()
+
+
+def shard_notes_table() -> Table:
+    """
+    Возвращает описание таблицы notes для баз-шардов: те же столбцы и индексы, что
+    у models.Note, но без внешних ключей на таблицы основной базы.
+    """
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key,
+               nullable=column.nullable, index=column.index)
+        for column in models.Note.__table__.columns
+    ]
+    return Table(models.Note.__tablename__, MetaData(), *columns)
+
+
+def create_router(shard_urls: Sequence[str], directory: sessionmaker = SessionLocal,
+                  id_block_size: int = 1000) -> ShardRouter:
+    """
+    Создает ShardRouter и таблицу заметок в каждой базе-шарде.
+
+    :param shard_urls: URL баз-шардов; пустой список — режим одной базы.
+    :param directory: Фабрика сессий основной базы.
+    :param id_block_size: Размер блока ID заметок.
+    """
+    shards = []
+    for url in shard_urls:
+        shard_engine = create_db_engine(url)
+        notes_table = shard_notes_table()
+        notes_table.create(bind=shard_engine, checkfirst=True)
+        add_missing_columns(shard_engine, notes_table)
+        shards.append(create_session_factory(shard_engine))
+    return ShardRouter(directory, shards, id_block_size=id_block_size)
+
+
+_router: Optional[ShardRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ShardRouter:
+    """
+    Возвращает общий ShardRouter, созданный по настройкам приложения.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = create_router(settings.shard_database_urls, id_block_size=settings.note_id_block_size)
+            if _router.distributed:
+                _warn_directory_notes(_router)
+        return _router
+
+
+def _warn_directory_notes(router: ShardRouter) -> None:
+    """
+    Предупреждает, если в основной базе остались заметки, недоступные при шардировании.
+    """
+    db = router.directory()
+    try:
+        if db.scalar(select(models.Note.id).limit(1)) is not None:
+            logger.warning("В основной базе есть заметки, недоступные при шардировании; "
+                           "перенесите их командой: python -m app.sharding import-directory")
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Инструменты шардирования заметок")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import-directory", help="Перенести заметки из основной базы в шарды владельцев")
+    move = commands.add_parser("move", help="Перенести заметки пользователя в другой шард")
+    move.add_argument("--user-id", type=int, required=True, help="Идентификатор пользователя")
+    move.add_argument("--shard", type=int, required=True, help="Номер целевого шарда")
+    commands.add_parser("rebalance", help="Перенести заметки в шарды владельцев после изменения списка шардов")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, models.Note.__table__)
+    if args.command == "import-directory":
+        moved = get_router().import_directory_notes()
+    elif args.command == "rebalance":
+        moved = get_router().rebalance()
+    else:
+        moved = get_router().move_user(args.user_id, args.shard)
+    print(f"Перенесено заметок: {moved}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Бенчмарк пропускной способности записи заметок в SQLite.
+
+Сравнивает текущий режим (каждая операция выполняет собственный commit) с групповой
+фиксацией через WriteBatcher. Конкурентные клиенты имитируются пулом потоков.
+
+Запуск из корня проекта:
+    python benchmarks/bench_write_batcher.py --ops 2000 --threads 16
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app import crud, models, schemas
+from app.batcher import WriteBatcher
+from app.database import Base
+
+
+def make_session_factory(path: str) -> sessionmaker:
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+        future=True
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+    db = factory()
+    db.add(models.User(username="bench", hashed_password="x", role="User"))
+    db.commit()
+    db.close()
+    return factory
+
+
+def run(label: str, ops: int, threads: int, write) -> None:
+    note = schemas.NoteCreate(title="Benchmark", body="x" * 256)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: write(note), range(ops)))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<24} {ops / elapsed:>10.0f} writes/s  ({elapsed:.2f} s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000, help="Число операций записи")
+    parser.add_argument("--threads", type=int, default=16, help="Число конкурентных клиентов")
+    parser.add_argument("--max-delay-ms", type=float, default=5.0, help="write_batch_max_delay_ms")
+    parser.add_argument("--max-size", type=int, default=64, help="write_batch_max_size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = make_session_factory(os.path.join(tmp, "per_request.db"))
+
+        def per_request(note):
+            db = factory()
+            try:
+                return crud.create_note(db, note, 1)
+            finally:
+                db.close()
+
+        run("per-request commit", args.ops, args.threads, per_request)
+
+        factory = make_session_factory(os.path.join(tmp, "batched.db"))
+        write_batcher = WriteBatcher(factory, max_delay=args.max_delay_ms / 1000, max_size=args.max_size)
+        try:
+            run("WriteBatcher", args.ops, args.threads,
+                lambda note: write_batcher.submit(crud.create_note, note, 1).result())
+        finally:
+            write_batcher.close()
+
+
+if __name__ == "__main__":
+    main()
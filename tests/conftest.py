@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+# Добавляем корневую директорию проекта в sys.path,
+# если она ещё не добавлена
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from fastapi.testclient import TestClient
+
+from app import database, models
+from app.database import Base, SessionLocal, create_db_engine, create_session_factory
+from app.main import app
+
+from query_budgets import QUERY_BUDGETS
+from query_counter import BudgetClient, QueryCounter
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """
+    Фикстура с отдельной SQLite-базой во временной директории.
+
+    В базе заранее создан пользователь с ID 1.
+    """
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    factory = create_session_factory(engine)
+    db = factory()
+    db.add(models.User(username="writer", hashed_password="x", role="User"))
+    db.commit()
+    db.close()
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def isolated_engine(tmp_path):
+    """
+    Фикстура, переключающая приложение на отдельную SQLite-базу во временной директории.
+
+    Общий notes.db из tests/test_main.py не затрагивается.
+    """
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    yield engine
+    SessionLocal.configure(bind=database.engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def budget_client(isolated_engine):
+    """
+    Фикстура клиента, проверяющего бюджет SQL-запросов каждого HTTP-запроса.
+
+    Бюджеты задаются в tests/query_budgets.py.
+    """
+    with QueryCounter(isolated_engine) as counter:
+        yield BudgetClient(TestClient(app), counter, QUERY_BUDGETS)
+
+
+@pytest.fixture
+def issue_tokens():
+    """
+    Фикстура-функция: регистрирует пользователя и возвращает ответ /token
+    (access_token и refresh_token).
+    """
+    def issue_tokens(client, username, role="User"):
+        response = client.post("/users/", json={"username": username, "password": "password1", "role": role})
+        assert response.status_code == 200, response.text
+        response = client.post("/token", data={"username": username, "password": "password1"})
+        assert response.status_code == 200, response.text
+        return response.json()
+    return issue_tokens
+
+
+@pytest.fixture
+def login(issue_tokens):
+    """
+    Фикстура-функция: регистрирует пользователя и возвращает заголовки авторизации для него.
+    """
+    def login(client, username, role="User"):
+        return {"Authorization": f"Bearer {issue_tokens(client, username, role)['access_token']}"}
+    return login
@@ -0,0 +1,48 @@
+"""
+Бюджеты SQL-запросов на один HTTP-запрос для каждого эндпоинта и HTTP-статуса ответа.
+
+Значение — точное число SQL-запросов, включая проверку токена (SELECT пользователя).
+Бюджеты задаются отдельно для каждого исхода: успешный путь и пути с ошибками обычно
+выполняют разное число запросов. Любое изменение числа запросов эндпоинта (в большую
+или меньшую сторону) должно сопровождаться правкой этой таблицы, чтобы оно было видно
+на ревью. Бюджеты рассчитаны на режим одной базы.
+"""
+
+QUERY_BUDGETS = {
+    # SELECT пользователя по имени + INSERT refresh-токена.
+    "POST /token": {200: 2},
+    # 200 при ротации: UPDATE ... RETURNING старого токена, INSERT нового, DELETE давно
+    # погашенных токенов цепочки, SELECT пользователя по ID (4). В окне одновременного
+    # обновления: UPDATE, INSERT ... SELECT, SELECT пользователя (3).
+    # 401 для неизвестного токена: UPDATE, INSERT ... SELECT, SELECT токена (3);
+    # при повторном использовании еще UPDATE цепочки (4).
+    "POST /token/refresh": {200: (3, 4), 401: (3, 4)},
+    # Один UPDATE цепочки с подзапросом по хэшу.
+    "POST /token/revoke": {200: 1},
+    # Проверка занятости имени, INSERT, обновление объекта; при занятом имени только проверка.
+    "POST /users/": {200: 3, 400: 1},
+    # Проверка токена + INSERT ... RETURNING.
+    "POST /notes/": {200: 2},
+    # Проверка токена + SELECT заметок владельца.
+    "GET /notes/": {200: 2},
+    # Проверка токена выполняется в короткоживущей сессии; сам поток к базе не обращается.
+    # Без токена или с некорректным JWT запрос отклоняется без обращения к базе.
+    "GET /notes/events": {200: 1, 401: 0},
+    # Проверка токена + SELECT заметки.
+    "GET /notes/{note_id}": {200: 2, 403: 2, 404: 2},
+    # Проверка токена + SELECT заметки; вынесенный текст читается с диска.
+    "GET /notes/{note_id}/body": {200: 2, 206: 2, 403: 2, 404: 2},
+    # Проверка токена + UPDATE ... RETURNING; при промахе еще SELECT для выбора 403/404.
+    "PUT /notes/{note_id}": {200: 2, 403: 3, 404: 3},
+    "DELETE /notes/{note_id}": {200: 2, 403: 3, 404: 3},
+    # Проверка токена + SELECT заметок (без ленивой загрузки владельцев).
+    "GET /admin/notes/": {200: 2},
+    "GET /admin/notes/user/{user_id}": {200: 2},
+    # Проверка токена + UPDATE ... RETURNING; при промахе еще SELECT для выбора 400/404.
+    "POST /admin/notes/{note_id}/restore": {200: 2, 400: 3, 404: 3},
+    # Проверка токена + UPDATE refresh-токенов пользователя.
+    "POST /admin/users/{user_id}/revoke-tokens": {200: 2},
+    # Проверка токена; снимки профилирования читаются с диска.
+    "GET /admin/profiles": {200: 1},
+    "GET /admin/profiles/{capture_id}": {200: 1, 404: 1},
+}
@@ -0,0 +1,113 @@
+"""
+Подсчет SQL-запросов на HTTP-запрос и проверка бюджетов из query_budgets.QUERY_BUDGETS.
+
+QueryCounter слушает событие before_cursor_execute движка и собирает выполненные
+запросы. BudgetClient оборачивает TestClient: перед каждым HTTP-запросом сбрасывает
+счетчик, а после него проверяет, что число запросов в точности совпадает с бюджетом
+эндпоинта для полученного HTTP-статуса и что ни один SQL-запрос не повторялся
+(типичный признак N+1). Точное совпадение делает видимым на ревью изменение числа
+запросов в любую сторону, в том числе возврат лишнего запроса на успешный путь,
+который укладывался бы в бюджет пути с ошибкой.
+"""
+
+from collections import Counter
+from typing import Dict, List, Tuple, Union
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+
+class QueryCounter:
+    """
+    Собирает SQL-запросы, выполненные через engine, пока счетчик активен.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.statements: List[Tuple[str, object]] = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    def reset(self) -> None:
+        self.statements.clear()
+
+    def repeated(self) -> Dict[str, int]:
+        """
+        Возвращает SQL-запросы (без учета параметров), выполненные более одного раза.
+        """
+        counts = Counter(statement for statement, _ in self.statements)
+        return {statement: count for statement, count in counts.items() if count > 1}
+
+    def check(self, endpoint: str, budget: Union[int, Tuple[int, ...]]) -> None:
+        """
+        Проверяет число запросов и отсутствие повторов.
+
+        :param endpoint: Описание запроса для сообщения об ошибке.
+        :param budget: Точное число запросов или кортеж допустимых значений, если при одном
+                       статусе возможны разные пути (например, 401 по разным причинам).
+        :raises AssertionError: Если число запросов отличается от бюджета или найдены повторяющиеся запросы.
+        """
+        allowed = budget if isinstance(budget, tuple) else (budget,)
+        listing = "\n".join(f"  {statement} {parameters}" for statement, parameters in self.statements)
+        assert len(self.statements) in allowed, (
+            f"{endpoint}: выполнено {len(self.statements)} SQL-запросов при бюджете {budget}:\n{listing}"
+        )
+        repeated = self.repeated()
+        assert not repeated, f"{endpoint}: повторяющиеся SQL-запросы (возможен N+1): {repeated}\n{listing}"
+
+
+class BudgetClient:
+    """
+    Обертка над TestClient, проверяющая бюджет SQL-запросов каждого HTTP-запроса.
+    """
+
+    def __init__(self, client: TestClient, counter: QueryCounter, budgets: Dict[str, Dict[int, Union[int, Tuple[int, ...]]]]):
+        self.client = client
+        self.counter = counter
+        self.budgets = budgets
+
+    def endpoint(self, method: str, url: str) -> str:
+        """
+        Возвращает ключ эндпоинта вида "GET /notes/{note_id}" для URL запроса.
+        """
+        path = url.split("?", 1)[0]
+        scope = {"type": "http", "path": path, "method": method.upper()}
+        for route in self.client.app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{method.upper()} {route.path}"
+        raise AssertionError(f"Маршрут для {method.upper()} {path} не найден")
+
+    def request(self, method: str, url: str, **kwargs):
+        endpoint = self.endpoint(method, url)
+        assert endpoint in self.budgets, f"Для {endpoint} не задан бюджет в tests/query_budgets.py"
+        self.counter.reset()
+        response = self.client.request(method, url, **kwargs)
+        budgets = self.budgets[endpoint]
+        assert response.status_code in budgets, (
+            f"Для {endpoint} со статусом {response.status_code} не задан бюджет в tests/query_budgets.py"
+        )
+        self.counter.check(f"{endpoint} -> {response.status_code}", budgets[response.status_code])
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request("DELETE", url, **kwargs)
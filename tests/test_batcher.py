@@ -0,0 +1,126 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from sqlalchemy.exc import OperationalError
+
+from app import batcher, crud, schemas
+from app.batcher import WriteBatcher
+from app.config import settings
+
+
+def test_concurrent_writes_are_applied(session_factory):
+    """
+    Тест проверяет, что конкурентные операции применяются и каждая получает свой результат.
+    """
+    write_batcher = WriteBatcher(session_factory, max_delay=0.01, max_size=16)
+    try:
+        def create(i):
+            note = schemas.NoteCreate(title=f"Note {i}", body="body")
+            return write_batcher.submit(crud.create_note, note, 1).result(timeout=5)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            notes = list(pool.map(create, range(50)))
+    finally:
+        write_batcher.close()
+
+    assert sorted(note.title for note in notes) == sorted(f"Note {i}" for i in range(50))
+    assert len({note.id for note in notes}) == 50, "У каждой заметки должен быть свой ID"
+    db = session_factory()
+    assert len(crud.get_notes_by_owner(db, 1)) == 50
+    db.close()
+
+
+def test_failed_operation_does_not_affect_batch(session_factory):
+    """
+    Тест проверяет, что ошибка одной операции достается только ее запросу.
+    """
+    def failing(db):
+        raise ValueError("boom")
+
+    write_batcher = WriteBatcher(session_factory, max_delay=0.05, max_size=16)
+    try:
+        ok = write_batcher.submit(crud.create_note, schemas.NoteCreate(title="ok", body="body"), 1)
+        bad = write_batcher.submit(failing)
+        assert ok.result(timeout=5).title == "ok"
+        with pytest.raises(ValueError):
+            bad.result(timeout=5)
+    finally:
+        write_batcher.close()
+
+    db = session_factory()
+    assert [note.title for note in crud.get_notes_by_owner(db, 1)] == ["ok"]
+    db.close()
+
+
+def test_writer_survives_unexpected_errors(session_factory):
+    """
+    Тест проверяет, что ошибка при откате пачки достается ее операциям, а писатель продолжает работу.
+    """
+    def failing(db):
+        raise ValueError("boom")
+
+    broken = [True]
+
+    def factory(**kwargs):
+        session = session_factory(**kwargs)
+        if broken[0]:
+            broken[0] = False
+
+            def rollback():
+                raise OperationalError("ROLLBACK", {}, Exception("connection lost"))
+            session.rollback = rollback
+        return session
+
+    write_batcher = WriteBatcher(factory, max_delay=0.05, max_size=16)
+    try:
+        ok = write_batcher.submit(crud.create_note, schemas.NoteCreate(title="lost", body="body"), 1)
+        bad = write_batcher.submit(failing)
+        with pytest.raises(OperationalError):
+            ok.result(timeout=5)
+        with pytest.raises(OperationalError):
+            bad.result(timeout=5)
+        later = write_batcher.submit(crud.create_note, schemas.NoteCreate(title="later", body="body"), 1)
+        assert later.result(timeout=5).title == "later"
+    finally:
+        write_batcher.close()
+
+
+def test_execute_wait_is_bounded(session_factory, monkeypatch):
+    """
+    Тест проверяет, что execute не ждет зависшего писателя бесконечно.
+    """
+    class StuckBatcher:
+        def submit(self, fn, *args, **kwargs):
+            return Future()
+
+    monkeypatch.setattr(batcher, "get_write_batcher", lambda bind: StuckBatcher())
+    monkeypatch.setattr(settings, "write_batch_timeout_seconds", 0.05)
+    db = session_factory()
+    try:
+        with pytest.raises(FutureTimeoutError):
+            batcher.execute(db, crud.create_note, schemas.NoteCreate(title="t", body="b"), 1)
+    finally:
+        db.close()
+
+
+def test_operations_on_same_note_get_own_results(session_factory):
+    """
+    Тест проверяет, что две мутации одной заметки в одной пачке получают каждая свой результат.
+    """
+    db = session_factory()
+    note = crud.create_note(db, schemas.NoteCreate(title="Old", body="body"), 1)
+    db.close()
+
+    write_batcher = WriteBatcher(session_factory, max_delay=0.2, max_size=16)
+    try:
+        updated = write_batcher.submit(crud.update_note, note.id, 1, schemas.NoteUpdate(title="A"))
+        deleted = write_batcher.submit(crud.delete_note, note.id, 1)
+        updated, deleted = updated.result(timeout=5), deleted.result(timeout=5)
+    finally:
+        write_batcher.close()
+
+    assert updated is not deleted
+    assert updated.title == "A" and updated.is_deleted is False
+    assert deleted.title == "A" and deleted.is_deleted is True
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from app import batcher, models
+from app.blobstore import BlobStore, collect_garbage, migrate_inline_bodies
+from app.config import settings
+from app.database import SessionLocal
+from app.sharding import ShardRouter
+
+BIG_BODY = "Большой текст. " * 20
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    Фикстура хранилища во временной директории с порогом 64 байта.
+    """
+    monkeypatch.setattr(settings, "blob_dir", str(tmp_path / "blobs"))
+    monkeypatch.setattr(settings, "blob_threshold_bytes", 64)
+    return BlobStore(settings.blob_dir)
+
+
+def test_store_is_disabled_by_default(budget_client, tmp_path, monkeypatch, login):
+    """
+    Тест проверяет, что без настройки blob_threshold_bytes тексты остаются в ответах API.
+    """
+    monkeypatch.setattr(settings, "blob_dir", str(tmp_path / "blobs"))
+    assert settings.blob_threshold_bytes == 0
+    headers = login(budget_client, "user")
+    note = budget_client.post("/notes/", json={"title": "Big", "body": BIG_BODY * 20}, headers=headers).json()
+    assert note["body"] == BIG_BODY * 20 and note["body_ref"] is None
+    assert not os.path.exists(settings.blob_dir)
+
+def test_large_body_is_served_from_store(budget_client, store, login):
+    """
+    Тест проверяет вынос большого текста, его выдачу с поддержкой Range и дедупликацию.
+    """
+    headers = login(budget_client, "user")
+    note = budget_client.post("/notes/", json={"title": "Big", "body": BIG_BODY}, headers=headers).json()
+    copy = budget_client.post("/notes/", json={"title": "Copy", "body": BIG_BODY}, headers=headers).json()
+    assert note["body"] == "" and note["body_ref"] is not None
+    assert copy["body_ref"] == note["body_ref"]
+    assert list(store.iter_digests()) == [note["body_ref"]]
+
+    response = budget_client.get(f"/notes/{note['id']}/body", headers=headers)
+    assert response.status_code == 200
+    assert response.text == BIG_BODY
+    assert response.headers["content-type"] == "text/plain; charset=utf-8"
+
+    response = budget_client.get(f"/notes/{note['id']}/body", headers={**headers, "Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.content == BIG_BODY.encode("utf-8")[:10]
+
+    stranger = login(budget_client, "stranger")
+    assert budget_client.get(f"/notes/{note['id']}/body", headers=stranger).status_code == 403
+
+
+def test_small_body_update_clears_reference(budget_client, store, login):
+    """
+    Тест проверяет, что короткий текст хранится в таблице и при обновлении заменяет вынесенный.
+    """
+    headers = login(budget_client, "user")
+    note = budget_client.post("/notes/", json={"title": "Big", "body": BIG_BODY}, headers=headers).json()
+    updated = budget_client.put(f"/notes/{note['id']}", json={"body": "Short"}, headers=headers).json()
+    assert updated["body"] == "Short" and updated["body_ref"] is None
+    assert budget_client.get(f"/notes/{note['id']}/body", headers=headers).text == "Short"
+
+
+def test_body_is_stored_outside_writer_thread(budget_client, store, monkeypatch, login):
+    """
+    Тест проверяет, что при групповой фиксации файл пишется в потоке запроса, а не писателя.
+    """
+    threads = []
+    put = BlobStore.put
+
+    def recording_put(self, data):
+        threads.append(threading.current_thread().name)
+        return put(self, data)
+
+    monkeypatch.setattr(BlobStore, "put", recording_put)
+    monkeypatch.setattr(settings, "write_batch_enabled", True)
+    try:
+        headers = login(budget_client, "user")
+        note = budget_client.post("/notes/", json={"title": "Big", "body": BIG_BODY}, headers=headers).json()
+        budget_client.put(f"/notes/{note['id']}", json={"body": BIG_BODY + "!"}, headers=headers)
+    finally:
+        batcher.shutdown_write_batcher()
+    assert len(threads) == 2 and "write-batcher" not in threads
+
+
+def test_garbage_collection_keeps_referenced_blobs(isolated_engine, store):
+    """
+    Тест проверяет, что сборщик мусора удаляет только старые файлы без ссылок.
+    """
+    referenced = store.put(b"referenced")
+    orphan = store.put(b"orphan")
+    fresh_orphan = store.put(b"fresh orphan")
+    old = time.time() - 7200
+    for digest in (referenced, orphan):
+        os.utime(store.path(digest), (old, old))
+
+    db = SessionLocal()
+    db.add(models.User(username="owner", hashed_password="x", role="User"))
+    db.add(models.Note(title="Note", body="", body_ref=referenced, owner_id=1))
+    db.commit()
+    db.close()
+
+    assert collect_garbage(ShardRouter(SessionLocal), store, grace_seconds=3600) == 1
+    assert sorted(store.iter_digests()) == sorted([referenced, fresh_orphan])
+
+
+def test_garbage_collection_keeps_blob_reused_during_collection(isolated_engine, store):
+    """
+    Тест проверяет, что файл, повторно использованный после чтения ссылок, не удаляется.
+    """
+    digest = store.put(b"reused")
+    old = time.time() - 7200
+    os.utime(store.path(digest), (old, old))
+
+    class ReusingRouter(ShardRouter):
+        def fan_out(self, fn):
+            results = super().fan_out(fn)
+            # Заметка с этим текстом создается между чтением ссылок и удалением.
+            store.put(b"reused")
+            return results
+
+    assert collect_garbage(ReusingRouter(SessionLocal), store, grace_seconds=3600) == 0
+    assert store.path(digest) is not None
+
+
+@pytest.mark.parametrize("reuse_after_rename", [False, True])
+def test_garbage_collection_delete_is_atomic_with_put(isolated_engine, store, monkeypatch, reuse_after_rename):
+    """
+    Тест проверяет, что put(), выполненный одновременно с удалением файла, не теряет файл.
+    """
+    digest = store.put(b"reused")
+    old = time.time() - 7200
+    os.utime(store.path(digest), (old, old))
+    rename = os.rename
+
+    def racing_rename(src, dst):
+        if not reuse_after_rename:
+            store.put(b"reused")
+        rename(src, dst)
+        if reuse_after_rename:
+            store.put(b"reused")
+
+    monkeypatch.setattr(os, "rename", racing_rename)
+    collect_garbage(ShardRouter(SessionLocal), store, grace_seconds=3600)
+    monkeypatch.setattr(os, "rename", rename)
+    with open(store.path(digest), "rb") as f:
+        assert f.read() == b"reused"
+
+
+def test_garbage_collection_restores_pending_files(isolated_engine, store):
+    """
+    Тест проверяет, что файл, отложенный прерванной сборкой мусора, возвращается на место.
+    """
+    digest = store.put(b"pending")
+    path = store.path(digest)
+    os.rename(path, f"{path}.{'0' * 32}.gc")
+    assert collect_garbage(ShardRouter(SessionLocal), store, grace_seconds=3600) == 0
+    assert store.path(digest) == path
+
+def test_migrate_inline_bodies(isolated_engine, store):
+    """
+    Тест проверяет перенос больших текстов из таблицы без изменения updated_at.
+    """
+    updated_at = datetime(2024, 1, 1)
+    db = SessionLocal()
+    db.add(models.User(username="owner", hashed_password="x", role="User"))
+    db.add(models.Note(title="Big", body=BIG_BODY, owner_id=1, updated_at=updated_at))
+    db.add(models.Note(title="Small", body="Short", owner_id=1, updated_at=updated_at))
+    db.commit()
+
+    assert migrate_inline_bodies(ShardRouter(SessionLocal), store) == 1
+    big, small = db.query(models.Note).order_by(models.Note.id).all()
+    db.close()
+    assert big.body == "" and big.updated_at == updated_at
+    with open(store.path(big.body_ref), encoding="utf-8") as f:
+        assert f.read() == BIG_BODY
+    assert small.body == "Short" and small.body_ref is None
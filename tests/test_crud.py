@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import event
+
+from app import crud, models, schemas
+
+
+@pytest.fixture
+def db(session_factory):
+    db = session_factory()
+    db.add(models.User(username="stranger", hashed_password="x", role="User"))
+    db.commit()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def statements(db):
+    """
+    Фикстура, собирающая SQL-запросы, выполненные через движок сессии.
+    """
+    executed = []
+    engine = db.get_bind()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def test_mutations_use_single_statement(db, statements):
+    """
+    Тест проверяет, что создание, обновление и удаление заметки выполняются одним запросом каждое.
+    """
+    note = crud.create_note(db, schemas.NoteCreate(title="Title", body="Body"), 1)
+    assert note.title == "Title" and note.id is not None
+    updated = crud.update_note(db, note.id, 1, schemas.NoteUpdate(title="New"))
+    assert updated.title == "New" and updated.body == "Body"
+    deleted = crud.delete_note(db, note.id, 1)
+    assert deleted.is_deleted is True
+    assert len(statements) == 3, statements
+
+
+def test_conditional_update_misses(db):
+    """
+    Тест проверяет, что чужие и удаленные заметки не изменяются.
+    """
+    note = crud.create_note(db, schemas.NoteCreate(title="Title", body="Body"), 1)
+    assert crud.update_note(db, note.id, 2, schemas.NoteUpdate(title="Hacked")) is None
+    assert crud.delete_note(db, note.id, 2) is None
+    assert crud.restore_note(db, note.id) is None
+
+    crud.delete_note(db, note.id, 1)
+    assert crud.update_note(db, note.id, 1, schemas.NoteUpdate(title="Late")) is None
+    restored = crud.restore_note(db, note.id)
+    assert restored.is_deleted is False and restored.title == "Title"
@@ -0,0 +1,175 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, events
+from app.config import settings
+from app.database import SessionLocal
+from app.events import Broker, EventBus, LocalBroker
+from app.main import app
+
+
+async def never_disconnected() -> bool:
+    return False
+
+
+def read_stream(bus, user_id, count, last_event_id=None, publish=None):
+    """
+    Читает count фрагментов потока; publish вызывается из другого потока после подписки.
+    """
+    async def run():
+        stream = bus.stream(user_id, last_event_id, never_disconnected, heartbeat=0.05)
+        chunks = [await stream.__anext__()]
+        if publish is not None:
+            await asyncio.to_thread(publish)
+        try:
+            while len(chunks) < count:
+                chunks.append(await stream.__anext__())
+        except StopAsyncIteration:
+            pass
+        await stream.aclose()
+        return chunks
+
+    return asyncio.run(run())
+
+
+def test_events_are_delivered_to_owner_only():
+    """
+    Тест проверяет доставку событий подписчику-владельцу и heartbeat при отсутствии событий.
+    """
+    bus = EventBus(LocalBroker())
+
+    def publish():
+        bus.publish(2, "note.created", '{"id": 1}')
+        bus.publish(1, "note.created", '{"id": 2}')
+
+    chunks = read_stream(bus, 1, 3, publish=publish)
+    assert chunks[0].startswith(b"retry:")
+    assert chunks[1] == b'id: 2\nevent: note.created\ndata: {"id": 2}\n\n'
+    assert chunks[2] == b": heartbeat\n\n"
+
+
+def test_resume_from_last_event_id():
+    """
+    Тест проверяет повторную отправку пропущенных событий по Last-Event-ID.
+    """
+    bus = EventBus(LocalBroker(), history_size=10)
+    for i in range(3):
+        bus.publish(1, "note.updated", f'{{"n": {i}}}')
+
+    chunks = read_stream(bus, 1, 3, last_event_id=1)
+    assert chunks[1].startswith(b"id: 2\n") and chunks[2].startswith(b"id: 3\n")
+
+    for i in range(20):
+        bus.publish(1, "note.updated", "{}")
+    chunks = read_stream(bus, 1, 2, last_event_id=1)
+    assert chunks[1] == b"event: reset\ndata: {}\n\n", "Вытесненные события должны приводить к reset"
+
+
+def test_slow_consumer_is_disconnected():
+    """
+    Тест проверяет, что клиент с переполненной очередью отключается.
+    """
+    bus = EventBus(LocalBroker(), queue_size=2)
+
+    def publish():
+        for i in range(5):
+            bus.publish(1, "note.created", "{}")
+
+    chunks = read_stream(bus, 1, 10, publish=publish)
+    assert len(chunks) == 1, "После переполнения очереди поток должен завершиться"
+
+
+def test_broker_is_abstract():
+    """
+    Тест проверяет, что брокер без реализации методов интерфейса создать нельзя.
+    """
+    class IncompleteBroker(Broker):
+        def publish(self, user_id, event_type, data):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteBroker()
+
+
+def test_events_endpoint_requires_token(budget_client):
+    """
+    Тест проверяет, что поток событий недоступен без действительного токена.
+    """
+    assert budget_client.get("/notes/events").status_code == 401
+    assert budget_client.get("/notes/events", headers={"Authorization": "Bearer bad"}).status_code == 401
+
+
+def test_mutations_are_streamed_after_commit(isolated_engine, monkeypatch, login):
+    """
+    Тест проверяет, что изменения заметок через API приходят в поток /notes/events владельца
+    и публикуются только после фиксации транзакции.
+    """
+    monkeypatch.setattr(settings, "sse_heartbeat_seconds", 0.05)
+    client = TestClient(app)
+    headers = login(client, "owner")
+    admin = login(client, "admin", role="Admin")
+
+    committed = []
+    publish_note = events.publish_note
+
+    def checking_publish_note(event_type, note):
+        # Изменение должно быть видно из другой сессии в момент публикации.
+        db = SessionLocal()
+        stored = crud.get_note(db, note.id)
+        committed.append((event_type, stored.title, stored.is_deleted))
+        db.close()
+        publish_note(event_type, note)
+
+    monkeypatch.setattr(events, "publish_note", checking_publish_note)
+
+    def mutate():
+        note_id = client.post("/notes/", json={"title": "Created", "body": "Body"}, headers=headers).json()["id"]
+        client.put(f"/notes/{note_id}", json={"title": "Updated"}, headers=headers)
+        client.delete(f"/notes/{note_id}", headers=headers)
+        client.post(f"/admin/notes/{note_id}/restore", headers=admin)
+
+    async def run():
+        chunks = []
+        disconnected = asyncio.Event()
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                assert message["status"] == 200
+            elif message["type"] == "http.response.body" and message.get("body"):
+                chunks.append(message["body"])
+                if len(chunks) == 1:
+                    asyncio.get_running_loop().create_task(asyncio.to_thread(mutate))
+                if sum(chunk.startswith(b"id:") for chunk in chunks) == 4:
+                    disconnected.set()
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/notes/events", "raw_path": b"/notes/events", "query_string": b"",
+            "root_path": "", "headers": [(b"authorization", headers["Authorization"].encode())],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        await asyncio.wait_for(app(scope, receive, send), timeout=10)
+        return chunks
+
+    chunks = asyncio.run(run())
+    received = [chunk.decode().split("\n") for chunk in chunks if chunk.startswith(b"id:")]
+    assert [lines[1] for lines in received] == [
+        "event: note.created", "event: note.updated", "event: note.deleted", "event: note.restored"
+    ]
+    assert json.loads(received[1][2][len("data: "):])["title"] == "Updated"
+    assert committed == [
+        ("note.created", "Created", False), ("note.updated", "Updated", False),
+        ("note.deleted", "Updated", True), ("note.restored", "Updated", False),
+    ]
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+
+import anyio.to_thread
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import profiling
+from app.config import settings
+from app.main import app
+
+
+@pytest.fixture
+def client(isolated_engine, tmp_path, monkeypatch):
+    """
+    Фикстура клиента с отдельной базой и временной директорией для профилей.
+    """
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path / "profiles"))
+    monkeypatch.setattr(settings, "profile_max_captures", 2)
+    return TestClient(app)
+
+
+def test_admin_header_captures_profile(client, login):
+    """
+    Тест проверяет профилирование по заголовку X-Profile и скачивание снимка.
+    """
+    admin = login(client, "admin", role="Admin")
+    response = client.get("/notes/", headers={**admin, "X-Profile": "1"})
+    assert response.status_code == 200
+    capture_id = response.headers["X-Profile-Id"]
+
+    profiles = client.get("/admin/profiles", headers=admin).json()
+    assert [profile["id"] for profile in profiles] == [capture_id]
+    assert profiles[0]["path"] == "/notes/" and profiles[0]["trigger"] == "header"
+
+    response = client.get(f"/admin/profiles/{capture_id}", headers=admin)
+    assert response.status_code == 200
+    statements = response.json()["statements"]
+    assert any("FROM notes" in statement["sql"] for statement in statements)
+    assert all(statement["duration_ms"] >= 0 for statement in statements)
+
+
+def test_header_from_non_admin_is_ignored(client, login):
+    """
+    Тест проверяет, что заголовок X-Profile от обычного пользователя игнорируется.
+    """
+    admin = login(client, "admin", role="Admin")
+    user = login(client, "user")
+    response = client.get("/notes/", headers={**user, "X-Profile": "1"})
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+    assert client.get("/admin/profiles", headers=admin).json() == []
+    assert client.get("/admin/profiles/not-a-profile", headers=admin).status_code == 404
+
+
+def test_sampling_and_ring_limit(client, monkeypatch, login):
+    """
+    Тест проверяет профилирование по выборке и ограничение числа хранимых снимков.
+    """
+    admin = login(client, "admin", role="Admin")
+    monkeypatch.setattr(settings, "profile_sample_rate", 1.0)
+    capture_ids = [client.get("/notes/", headers=admin).headers["X-Profile-Id"] for _ in range(3)]
+    monkeypatch.setattr(settings, "profile_sample_rate", 0.0)
+
+    profiles = client.get("/admin/profiles", headers=admin).json()
+    assert [profile["id"] for profile in profiles] == capture_ids[:0:-1]
+    assert all(profile["trigger"] == "sample" for profile in profiles)
+
+
+def test_capture_does_not_store_parameters(client, monkeypatch):
+    """
+    Тест проверяет, что в снимок не попадают параметры SQL-запросов (например, хэш пароля).
+    """
+    monkeypatch.setattr(settings, "profile_sample_rate", 1.0)
+    response = client.post("/users/", json={"username": "secret", "password": "password1", "role": "User"})
+    monkeypatch.setattr(settings, "profile_sample_rate", 0.0)
+
+    store = profiling.get_profile_store()
+    with open(store.path(response.headers["X-Profile-Id"]), encoding="utf-8") as f:
+        data = f.read()
+    statements = json.loads(data)["statements"]
+    assert any("INSERT INTO users" in statement["sql"] for statement in statements)
+    assert all(set(statement) == {"sql", "duration_ms"} for statement in statements)
+    assert "$2b$" not in data and "secret" not in data
+
+def test_hooks_are_removed_after_capture(client, login):
+    """
+    Тест проверяет, что после профилирования обработчики SQL-событий и обертка пула отключаются.
+    """
+    admin = login(client, "admin", role="Admin")
+    assert client.get("/notes/", headers={**admin, "X-Profile": "1"}).headers["X-Profile-Id"]
+    assert not event.contains(Engine, "before_cursor_execute", profiling._before_cursor_execute)
+    assert not event.contains(Engine, "after_cursor_execute", profiling._after_cursor_execute)
+    assert anyio.to_thread.run_sync is profiling._original_run_sync
+
+
+def profiled_work():
+    time.sleep(0.3)
+
+
+def other_work():
+    deadline = time.perf_counter() + 0.3
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_concurrent_request_is_not_sampled(client, monkeypatch):
+    """
+    Тест проверяет, что стеки конкурентного запроса без профилирования не попадают в снимок.
+    """
+    monkeypatch.setattr(profiling, "_is_admin", lambda authorization: True)
+    demo = FastAPI()
+    demo.add_middleware(profiling.ProfilingMiddleware)
+    demo.get("/profiled")(profiled_work)
+    demo.get("/other")(other_work)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=demo), base_url="http://test") as http:
+            profiled = http.get("/profiled", headers={"X-Profile": "1"})
+            return await asyncio.gather(profiled, http.get("/other"))
+
+    profiled, other = asyncio.run(run())
+    assert "X-Profile-Id" not in other.headers
+    path = profiling.get_profile_store().path(profiled.headers["X-Profile-Id"])
+    with open(path, encoding="utf-8") as f:
+        stacks = json.load(f)["samples"]
+    assert any("profiled_work" in stack for stack in stacks)
+    assert not any("other_work" in stack for stack in stacks)
@@ -0,0 +1,79 @@
+import pytest
+from fastapi.routing import APIRoute
+from sqlalchemy import text
+
+from app.main import app
+
+from query_budgets import QUERY_BUDGETS
+from query_counter import QueryCounter
+
+
+def test_every_route_has_budget():
+    """
+    Тест проверяет, что у каждого эндпоинта приложения есть бюджет SQL-запросов.
+    """
+    endpoints = {
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+    }
+    assert endpoints - set(QUERY_BUDGETS) == set(), "Добавьте бюджеты в tests/query_budgets.py"
+
+
+def test_user_endpoints_within_budget(budget_client, login):
+    """
+    Тест проверяет бюджеты эндпоинтов заметок пользователя, включая ошибки доступа.
+    """
+    owner = login(budget_client, "owner")
+    stranger = login(budget_client, "stranger")
+
+    note_ids = [
+        budget_client.post("/notes/", json={"title": f"Note {i}", "body": "Body"}, headers=owner).json()["id"]
+        for i in range(5)
+    ]
+    assert len(budget_client.get("/notes/", headers=owner).json()) == 5
+    assert budget_client.get(f"/notes/{note_ids[0]}", headers=owner).status_code == 200
+    assert budget_client.put(f"/notes/{note_ids[0]}", json={"title": "New"}, headers=owner).status_code == 200
+    assert budget_client.put(f"/notes/{note_ids[0]}", json={"title": "X"}, headers=stranger).status_code == 403
+    assert budget_client.delete(f"/notes/{note_ids[1]}", headers=owner).status_code == 200
+    assert budget_client.delete(f"/notes/{note_ids[1]}", headers=owner).status_code == 404
+
+
+def test_admin_endpoints_within_budget(budget_client, login):
+    """
+    Тест проверяет бюджеты эндпоинтов администратора на заметках нескольких владельцев.
+    """
+    admin = login(budget_client, "admin", role="Admin")
+    owners = [login(budget_client, f"user{i}") for i in range(3)]
+    note_ids = [
+        budget_client.post("/notes/", json={"title": "Note", "body": "Body"}, headers=headers).json()["id"]
+        for headers in owners for _ in range(2)
+    ]
+    budget_client.delete(f"/notes/{note_ids[0]}", headers=owners[0])
+
+    assert len(budget_client.get("/admin/notes/", headers=admin).json()) == 5
+    assert len(budget_client.get("/admin/notes/user/2", headers=admin).json()) == 2
+    assert budget_client.post(f"/admin/notes/{note_ids[0]}/restore", headers=admin).status_code == 200
+    assert budget_client.post(f"/admin/notes/{note_ids[0]}/restore", headers=admin).status_code == 400
+
+
+def test_budget_is_exact(isolated_engine):
+    """
+    Тест проверяет, что меньшее число запросов, чем в бюджете, тоже считается расхождением.
+    """
+    with QueryCounter(isolated_engine) as counter, isolated_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    counter.check("GET /example", budget=1)
+    with pytest.raises(AssertionError, match="при бюджете 2"):
+        counter.check("GET /example", budget=2)
+
+
+def test_repeated_statements_are_detected(isolated_engine):
+    """
+    Тест проверяет, что счетчик обнаруживает повторяющиеся запросы (N+1).
+    """
+    with QueryCounter(isolated_engine) as counter, isolated_engine.connect() as conn:
+        for user_id in (1, 2):
+            conn.execute(text("SELECT * FROM users WHERE id = :id"), {"id": user_id})
+    with pytest.raises(AssertionError, match="N\\+1"):
+        counter.check("GET /example", budget=2)
@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import auth, models
+from app.config import settings
+from app.database import SessionLocal
+from app.main import app
+
+
+def refresh(client, refresh_token):
+    return client.post("/token/refresh", data={"refresh_token": refresh_token})
+
+
+def test_refresh_rotates_tokens(budget_client, issue_tokens):
+    """
+    Тест проверяет обмен refresh-токена на новую пару токенов.
+    """
+    tokens = issue_tokens(budget_client, "user")
+    response = refresh(budget_client, tokens["refresh_token"])
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+
+    headers = {"Authorization": f"Bearer {rotated['access_token']}"}
+    assert budget_client.get("/notes/", headers=headers).status_code == 200
+    assert refresh(budget_client, rotated["refresh_token"]).status_code == 200
+
+
+def test_reuse_revokes_family(budget_client, monkeypatch, issue_tokens):
+    """
+    Тест проверяет, что повторное использование токена отзывает всю цепочку.
+    """
+    monkeypatch.setattr(settings, "refresh_token_reuse_grace_seconds", 0)
+    tokens = issue_tokens(budget_client, "user")
+    rotated = refresh(budget_client, tokens["refresh_token"]).json()
+
+    assert refresh(budget_client, tokens["refresh_token"]).status_code == 401
+    assert refresh(budget_client, rotated["refresh_token"]).status_code == 401
+    assert refresh(budget_client, "not-a-token").status_code == 401
+
+
+def test_logout_and_admin_revocation(budget_client, issue_tokens):
+    """
+    Тест проверяет выход из системы и отзыв всех токенов пользователя администратором.
+    """
+    admin = issue_tokens(budget_client, "admin", role="Admin")
+    first = issue_tokens(budget_client, "user")
+    second = budget_client.post("/token", data={"username": "user", "password": "password1"}).json()
+
+    response = budget_client.post("/token/revoke", data={"refresh_token": first["refresh_token"]})
+    assert response.json() == {"revoked": 1}
+    assert refresh(budget_client, first["refresh_token"]).status_code == 401
+
+    headers = {"Authorization": f"Bearer {admin['access_token']}"}
+    response = budget_client.post("/admin/users/2/revoke-tokens", headers=headers)
+    assert response.json() == {"revoked": 1}
+    assert refresh(budget_client, second["refresh_token"]).status_code == 401
+
+
+def test_concurrent_refresh_within_grace_period(budget_client, issue_tokens):
+    """
+    Тест проверяет, что одновременное обновление одного токена из нескольких вкладок
+    не отзывает цепочку: каждая вкладка получает рабочий токен.
+    """
+    tokens = issue_tokens(budget_client, "user")
+    client = TestClient(app)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(pool.map(lambda _: refresh(client, tokens["refresh_token"]), range(2)))
+    assert [response.status_code for response in responses] == [200, 200]
+    for response in responses:
+        assert refresh(budget_client, response.json()["refresh_token"]).status_code == 200
+
+
+def test_grace_period_does_not_outlive_logout(budget_client, issue_tokens):
+    """
+    Тест проверяет, что после выхода недавно погашенный токен не принимается.
+    """
+    tokens = issue_tokens(budget_client, "user")
+    rotated = refresh(budget_client, tokens["refresh_token"]).json()
+    budget_client.post("/token/revoke", data={"refresh_token": rotated["refresh_token"]})
+    assert refresh(budget_client, tokens["refresh_token"]).status_code == 401
+
+
+def test_old_tokens_are_pruned(budget_client, issue_tokens):
+    """
+    Тест проверяет удаление истекших и давно погашенных токенов при ротации и обслуживании.
+    """
+    tokens = issue_tokens(budget_client, "user")
+    for _ in range(3):
+        tokens = refresh(budget_client, tokens["refresh_token"]).json()
+    abandoned = issue_tokens(budget_client, "other")
+
+    long_ago = datetime.utcnow() - settings.refresh_token_retention - timedelta(days=1)
+    db = SessionLocal()
+    db.query(models.RefreshToken).filter(models.RefreshToken.revoked_at.isnot(None)).update(
+        {"revoked_at": long_ago}, synchronize_session=False
+    )
+    db.query(models.RefreshToken).filter(models.RefreshToken.user_id == 2).update(
+        {"expires_at": long_ago}, synchronize_session=False
+    )
+    db.commit()
+
+    # Ротация удаляет давно погашенные токены своей цепочки.
+    refresh(budget_client, tokens["refresh_token"])
+    assert db.query(models.RefreshToken).filter(models.RefreshToken.user_id == 1).count() == 2
+
+    # Обслуживание удаляет истекшие токены цепочек, которые больше не обновляются.
+    assert auth.prune_refresh_tokens() == 1
+    assert refresh(budget_client, abandoned["refresh_token"]).status_code == 401
+    db.close()
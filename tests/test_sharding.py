@@ -0,0 +1,160 @@
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+from app import crud, models, schemas
+from app.database import Base, create_db_engine, create_session_factory
+from app.sharding import create_router, shard_notes_table, stable_shard
+
+SHARD_COUNT = 3
+
+
+@pytest.fixture
+def router(tmp_path):
+    """
+    Фикстура с каталогом и тремя шардами в отдельных SQLite-файлах.
+
+    В каталоге созданы пользователи с ID 1..10.
+    """
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'directory.db'}")
+    Base.metadata.create_all(bind=engine)
+    directory = create_session_factory(engine)
+    db = directory()
+    db.add_all(models.User(username=f"user{i}", hashed_password="x") for i in range(1, 11))
+    db.commit()
+    db.close()
+
+    shard_urls = [f"sqlite:///{tmp_path / f'shard{i}.db'}" for i in range(SHARD_COUNT)]
+    yield create_router(shard_urls, directory=directory, id_block_size=4)
+    engine.dispose()
+
+
+def create_notes(router, owner_id, count):
+    db = router.directory()
+    try:
+        with router.session_for_owner(owner_id, db) as notes_db:
+            return [
+                crud.create_note(notes_db, schemas.NoteCreate(title=f"{owner_id}-{i}", body="body"),
+                                 owner_id, router.allocate_note_id())
+                for i in range(count)
+            ]
+    finally:
+        db.close()
+
+
+def notes_per_shard(router, owner_id):
+    return router.fan_out(lambda s: len(crud.get_notes_by_user(s, owner_id)))
+
+
+def test_notes_are_routed_by_owner(router):
+    """
+    Тест проверяет, что заметки попадают в шард владельца, а ID уникальны во всех шардах.
+    """
+    notes = [note for owner_id in range(1, 11) for note in create_notes(router, owner_id, 3)]
+    assert len({note.id for note in notes}) == len(notes)
+    for owner_id in range(1, 11):
+        expected = [0] * SHARD_COUNT
+        expected[stable_shard(owner_id, SHARD_COUNT)] = 3
+        assert notes_per_shard(router, owner_id) == expected
+    assert router.find_note(None, notes[-1].id).title == "10-2"
+
+
+def test_get_all_notes_merges_pages(router):
+    """
+    Тест проверяет, что страницы всех шардов объединяются по возрастанию ID.
+    """
+    for owner_id in range(1, 11):
+        create_notes(router, owner_id, 2)
+    all_ids = [note.id for note in router.get_all_notes(None)]
+    assert all_ids == sorted(all_ids) and len(all_ids) == 20
+    page = router.get_all_notes(None, skip=5, limit=7)
+    assert [note.id for note in page] == all_ids[5:12]
+
+
+def test_move_user(router):
+    """
+    Тест проверяет перенос заметок пользователя в другой шард.
+    """
+    notes = create_notes(router, 1, 5)
+    source = stable_shard(1, SHARD_COUNT)
+    target = (source + 1) % SHARD_COUNT
+
+    assert router.move_user(1, target) == 5
+    expected = [0] * SHARD_COUNT
+    expected[target] = 5
+    assert notes_per_shard(router, 1) == expected
+
+    db = router.directory()
+    assert router.shard_for(1, db) == target
+    with router.session_for_owner(1, db) as notes_db:
+        moved = crud.get_notes_by_owner(notes_db, 1)
+    db.close()
+    assert sorted(note.id for note in moved) == sorted(note.id for note in notes)
+
+
+def test_shard_table_has_no_cross_database_foreign_key(router):
+    """
+    Тест проверяет, что таблица заметок в шардах не ссылается на users из основной базы.
+    """
+    ddl = str(CreateTable(shard_notes_table()).compile(dialect=postgresql.dialect()))
+    assert "REFERENCES" not in ddl
+    shard_engine = router.shards[0].kw["bind"]
+    assert inspect(shard_engine).get_foreign_keys("notes") == []
+    assert {index["name"] for index in inspect(shard_engine).get_indexes("notes")} == {"ix_notes_id", "ix_notes_body_ref"}
+
+
+def test_import_directory_notes(router):
+    """
+    Тест проверяет перенос заметок, созданных до включения шардирования, в шарды владельцев.
+    """
+    db = router.directory()
+    for owner_id in range(1, 11):
+        crud.create_note(db, schemas.NoteCreate(title=f"{owner_id}", body="body"), owner_id)
+    db.close()
+
+    assert router.import_directory_notes(batch_size=3) == 10
+    assert router.import_directory_notes() == 0
+    for owner_id in range(1, 11):
+        expected = [0] * SHARD_COUNT
+        expected[stable_shard(owner_id, SHARD_COUNT)] = 1
+        assert notes_per_shard(router, owner_id) == expected
+    assert router.allocate_note_id() == 11
+
+
+def test_pin_to_removed_shard_falls_back_to_hash(router):
+    """
+    Тест проверяет, что закрепление за несуществующим шардом не приводит к ошибке.
+    """
+    db = router.directory()
+    crud.set_user_shard(db, 1, SHARD_COUNT + 2)
+    assert router.shard_for(1, db) == stable_shard(1, SHARD_COUNT)
+    db.close()
+
+
+def test_rebalance_after_adding_shard(router, tmp_path):
+    """
+    Тест проверяет перенос заметок в шарды, вычисляемые по новому числу шардов.
+    """
+    for owner_id in range(1, 11):
+        create_notes(router, owner_id, 2)
+    db = router.directory()
+    pinned = stable_shard(1, SHARD_COUNT)
+    crud.set_user_shard(db, 1, pinned)
+    db.close()
+    create_notes(router, 1, 1)
+
+    urls = [str(factory.kw["bind"].url) for factory in router.shards] + [f"sqlite:///{tmp_path / 'shard3.db'}"]
+    resized = create_router(urls, directory=router.directory, id_block_size=4)
+    expected_moves = sum(2 for owner_id in range(2, 11) if stable_shard(owner_id, 3) != stable_shard(owner_id, 4))
+    assert expected_moves > 0
+
+    assert resized.rebalance() == expected_moves
+    assert resized.rebalance() == 0
+    for owner_id in range(2, 11):
+        expected = [0] * (SHARD_COUNT + 1)
+        expected[stable_shard(owner_id, SHARD_COUNT + 1)] = 2
+        assert notes_per_shard(resized, owner_id) == expected
+    expected = [0] * (SHARD_COUNT + 1)
+    expected[pinned] = 3
+    assert notes_per_shard(resized, 1) == expected